@@ -0,0 +1,157 @@
+import math
+import time
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict
+from config import (ADMISSION_MAX_WAIT_SECONDS, EMBEDDING_CONCURRENCY, EMBEDDING_QUEUE_SIZE,
+                    VECTOR_QUERY_CONCURRENCY, VECTOR_QUERY_QUEUE_SIZE, LLM_CONCURRENCY,
+                    LLM_DEFAULT_CONCURRENCY, LLM_QUEUE_SIZE)
+
+# 请求优先级：交互式问答优先于批量任务（上传入库、批量问答、后台摘要）
+INTERACTIVE = 0
+BULK = 1
+
+
+class AdmissionRejected(Exception):
+    """队列已满或等待超时，请求被拒绝"""
+
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"服务繁忙（{stage}），请 {retry_after} 秒后重试")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageLimiter:
+    """单个处理阶段的并发限制：超出并发的请求按优先级排队，队列满或等待超时时立即拒绝
+
+    批量请求最多占用一半的排队位置，为交互式请求保留空间。
+    """
+
+    def __init__(self, name: str, max_concurrency: int, max_queue: int,
+                 max_wait: float = ADMISSION_MAX_WAIT_SECONDS):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queue = []  # (优先级, 序号) 小顶堆
+        self._tickets = itertools.count()
+        # 统计信息
+        self._admitted = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait_seen = 0.0
+        self._avg_service = 1.0  # 处理耗时的指数滑动平均（秒）
+
+    def _retry_after(self) -> int:
+        return max(1, math.ceil(self._avg_service * (len(self._queue) + 1) / self.max_concurrency))
+
+    def _reject(self) -> AdmissionRejected:
+        self._rejected += 1
+        return AdmissionRejected(self.name, self._retry_after())
+
+    def _enter(self, priority: int, blocking: bool):
+        with self._cond:
+            if self._active < self.max_concurrency and not self._queue:
+                self._active += 1
+                self._admitted += 1
+                return
+            if not blocking:
+                if priority == INTERACTIVE:
+                    queued, queue_limit = len(self._queue), self.max_queue
+                else:
+                    queued = sum(1 for p, _ in self._queue if p != INTERACTIVE)
+                    queue_limit = self.max_queue // 2
+                if queued >= queue_limit:
+                    raise self._reject()
+            entry = (priority, next(self._tickets))
+            heapq.heappush(self._queue, entry)
+            started = time.monotonic()
+            deadline = math.inf if blocking else started + self.max_wait
+            while not (self._active < self.max_concurrency and self._queue[0] == entry):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    self._cond.notify_all()
+                    raise self._reject()
+                self._cond.wait(None if blocking else remaining)
+            heapq.heappop(self._queue)
+            self._active += 1
+            waited = time.monotonic() - started
+            self._admitted += 1
+            self._total_wait += waited
+            self._max_wait_seen = max(self._max_wait_seen, waited)
+            # 仍有空闲并发时唤醒下一个排队请求
+            self._cond.notify_all()
+
+    def _leave(self, service_time: float):
+        with self._cond:
+            self._active -= 1
+            self._avg_service = 0.8 * self._avg_service + 0.2 * service_time
+            self._cond.notify_all()
+
+    @contextmanager
+    def acquire(self, priority: int = INTERACTIVE, blocking: bool = False):
+        """占用一个并发名额，无法获得时抛出AdmissionRejected
+
+        blocking为True时一直排队等待，不受队列长度和等待时间限制（用于并发已受控的后台任务）。
+        """
+        self._enter(priority, blocking)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self._leave(time.monotonic() - started)
+
+    def metrics(self) -> Dict:
+        with self._cond:
+            return {
+                "active": self._active,
+                "max_concurrency": self.max_concurrency,
+                "queue_depth": len(self._queue),
+                "queue_interactive": sum(1 for p, _ in self._queue if p == INTERACTIVE),
+                "max_queue": self.max_queue,
+                "admitted": self._admitted,
+                "rejected": self._rejected,
+                "avg_wait_ms": round(self._total_wait / self._admitted * 1000, 1) if self._admitted else 0.0,
+                "max_wait_ms": round(self._max_wait_seen * 1000, 1),
+                "avg_service_ms": round(self._avg_service * 1000, 1)
+            }
+
+
+class AdmissionController:
+    """各处理阶段的并发限制：嵌入计算、向量查询、按服务商区分的大模型调用"""
+
+    def __init__(self):
+        self.embedding = StageLimiter("embedding", EMBEDDING_CONCURRENCY, EMBEDDING_QUEUE_SIZE)
+        self.vector_query = StageLimiter("vector_query", VECTOR_QUERY_CONCURRENCY, VECTOR_QUERY_QUEUE_SIZE)
+        self._llm: Dict[str, StageLimiter] = {}
+        self._lock = threading.Lock()
+
+    def llm(self, provider: str) -> StageLimiter:
+        """获取大模型服务商对应的并发限制（首次使用时创建）"""
+        with self._lock:
+            limiter = self._llm.get(provider)
+            if limiter is None:
+                limiter = StageLimiter(f"llm:{provider}",
+                                       LLM_CONCURRENCY.get(provider, LLM_DEFAULT_CONCURRENCY), LLM_QUEUE_SIZE)
+                self._llm[provider] = limiter
+            return limiter
+
+    def max_waiters(self, providers) -> int:
+        """所有阶段同时占用或排队的请求数上限（每个请求在等待期间占用一个工作线程）"""
+        total = (self.embedding.max_concurrency + self.embedding.max_queue
+                 + self.vector_query.max_concurrency + self.vector_query.max_queue)
+        for provider in providers:
+            limiter = self.llm(provider)
+            total += limiter.max_concurrency + limiter.max_queue
+        return total
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            limiters = [self.embedding, self.vector_query] + list(self._llm.values())
+        return {limiter.name: limiter.metrics() for limiter in limiters}
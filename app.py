@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 import os
+import uuid
 import urllib.parse
 
 # 页面配置
@@ -14,9 +15,44 @@ st.set_page_config(
 # API基础URL
 API_BASE = "http://localhost:8000"
 
+
+def 获取会话() -> requests.Session:
+    """当前浏览器会话复用的HTTP会话（requests.Session不保证线程安全，不在浏览器会话之间共享）"""
+    if "HTTP会话" not in st.session_state:
+        st.session_state.HTTP会话 = requests.Session()
+    return st.session_state.HTTP会话
+
+
+@st.cache_resource
+def 获取响应缓存():
+    """按URL缓存GET响应：{url: (ETag, 数据)}"""
+    return {}
+
+
+会话 = 获取会话()
+
+
+def 条件请求(路径: str):
+    """带ETag校验的GET请求，内容未变化时(304)直接返回本地缓存"""
+    缓存 = 获取响应缓存()
+    url = f"{API_BASE}{路径}"
+    已缓存 = 缓存.get(url)
+    请求头 = {"If-None-Match": 已缓存[0]} if 已缓存 else {}
+    响应 = 会话.get(url, headers=请求头, timeout=10)
+    if 响应.status_code == 304 and 已缓存:
+        return 已缓存[1]
+    响应.raise_for_status()
+    数据 = 响应.json()
+    if 响应.headers.get("ETag"):
+        缓存[url] = (响应.headers["ETag"], 数据)
+    return 数据
+
 # 初始化会话状态
 if "聊天记录" not in st.session_state:
     st.session_state.聊天记录 = []
+if "会话ID" not in st.session_state:
+    # 服务端对话会话ID（追问时后端复用上文的检索结果和对话历史）
+    st.session_state.会话ID = uuid.uuid4().hex
 if "已上传文档" not in st.session_state:
     st.session_state.已上传文档 = []
 if "文档ID到名称" not in st.session_state:
@@ -29,6 +65,8 @@ if "当前文件名称" not in st.session_state:
     st.session_state.当前文件名称 = None
 if "当前文件截断" not in st.session_state:
     st.session_state.当前文件截断 = False
+if "仅问当前文档" not in st.session_state:
+    st.session_state.仅问当前文档 = False
 if "当前模型" not in st.session_state:
     st.session_state.当前模型 = "deepseek"  # 默认模型
 
@@ -36,14 +74,12 @@ if "当前模型" not in st.session_state:
 def 加载文档列表():
     """加载文档列表"""
     try:
-        响应 = requests.get(f"{API_BASE}/documents")
-        if 响应.status_code == 200:
-            原始文档列表 = 响应.json()["documents"]
-            st.session_state.已上传文档 = 原始文档列表
-            return True
-        else:
-            st.session_state.已上传文档 = []
-            return False
+        原始文档列表 = 条件请求("/documents")["documents"]
+        st.session_state.已上传文档 = 原始文档列表
+        return True
+    except requests.HTTPError:
+        st.session_state.已上传文档 = []
+        return False
     except Exception as 错误:
         st.error(f"无法连接到后端服务: {错误}")
         st.session_state.已上传文档 = []
@@ -53,11 +89,7 @@ def 加载文档列表():
 def 获取可用模型():
     """获取可用的AI模型列表"""
     try:
-        响应 = requests.get(f"{API_BASE}/models")
-        if 响应.status_code == 200:
-            return 响应.json()["available_models"]
-        else:
-            return ["deepseek", "zhipu"]  # 默认列表
+        return 条件请求("/models")["available_models"]
     except:
         return ["deepseek", "zhipu"]  # 默认列表
 
@@ -98,7 +130,7 @@ def 主函数():
                     try:
                         编码后的文件名 = urllib.parse.quote(上传的文件.name)
                         文件数据 = {"file": (编码后的文件名, 上传的文件.getvalue())}
-                        响应 = requests.post(f"{API_BASE}/upload", files=文件数据)
+                        响应 = 会话.post(f"{API_BASE}/upload", files=文件数据)
 
                         if 响应.status_code == 200:
                             结果 = 响应.json()
@@ -137,7 +169,7 @@ def 主函数():
                             try:
                                 if 文档ID:
                                     编码后的文档ID = urllib.parse.quote(文档ID)
-                                    响应 = requests.get(f"{API_BASE}/documents/{编码后的文档ID}/content")
+                                    响应 = 会话.get(f"{API_BASE}/documents/{编码后的文档ID}/content")
                                     if 响应.status_code == 200:
                                         结果 = 响应.json()
                                         st.session_state.当前文件内容 = 结果["content"]
@@ -154,7 +186,7 @@ def 主函数():
                         try:
                             if 文档ID:
                                 编码后的文档ID = urllib.parse.quote(文档ID)
-                                响应 = requests.delete(f"{API_BASE}/documents/{编码后的文档ID}")
+                                响应 = 会话.delete(f"{API_BASE}/documents/{编码后的文档ID}")
                                 if 响应.status_code == 200:
                                     st.success("文档已删除")
                                     if 原始文件名 in st.session_state.名称到文档ID:
@@ -221,6 +253,11 @@ def 主函数():
                 )
                 if st.session_state.当前文件截断:
                     st.info("⚠️ 注意：文件内容过长，已截断显示部分内容")
+            st.checkbox(
+                "🔍 仅针对此文档提问",
+                key="仅问当前文档",
+                help="勾选后只在当前预览的文档中检索答案"
+            )
             st.divider()
 
         # 下半部分：问答区域
@@ -253,9 +290,13 @@ def 主函数():
                     try:
                         编码后的问题 = urllib.parse.quote(问题)
                         # 添加模型参数
-                        url = f"{API_BASE}/chat?question={编码后的问题}&model={st.session_state.当前模型}"
+                        url = (f"{API_BASE}/chat?question={编码后的问题}&model={st.session_state.当前模型}"
+                               f"&session_id={st.session_state.会话ID}")
+                        # 仅针对当前预览文档提问时，限定检索范围
+                        if st.session_state.仅问当前文档 and st.session_state.当前文件名称:
+                            url += f"&sources={urllib.parse.quote(st.session_state.当前文件名称)}"
 
-                        响应 = requests.post(url)
+                        响应 = 会话.post(url)
 
                         if 响应.status_code == 200:
                             结果 = 响应.json()
@@ -274,6 +315,8 @@ def 主函数():
                                 "来源": 结果.get("sources", []),
                                 "模型": 结果.get("model_used", st.session_state.当前模型)
                             })
+                        elif 响应.status_code == 429:
+                            st.warning(f"服务繁忙，请 {响应.headers.get('Retry-After', '几')} 秒后重试")
                         else:
                             st.error(f"获取回答失败 (状态码: {响应.status_code})")
                             try:
@@ -1,19 +1,101 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, JSONResponse
+from pydantic import BaseModel
 import os
 import uuid
+import time
+import hashlib
+from contextlib import contextmanager
+from email.utils import formatdate, parsedate_to_datetime
 import urllib.parse
-from typing import List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple, Dict, Optional
 from document_processor import DocumentProcessor
-from vector_db import VectorDatabase
-from config import UPLOAD_FOLDER, ALLOWED_EXTENSIONS, AI_MODELS, DEFAULT_AI_MODEL
+from vector_db import (VectorDatabase, WorkspaceManager, WORKSPACE_NAME_PATTERN, build_where_filter,
+                       filter_by_relevance)
+from document_registry import DocumentRegistry
+from summarizer import is_summary_question, summarize_chunks
+from maintenance import MaintenanceTask, start_background_maintenance, list_workspaces
+from admission import AdmissionController, AdmissionRejected, INTERACTIVE, BULK
+from text_cache import TextCache
+from reindex import Reindexer
+from encode_pool import encode_pool_reports, close_encode_pools
+from chat_session import ChatSessionStore, is_followup
+from config import (UPLOAD_FOLDER, ALLOWED_EXTENSIONS, AI_MODELS, DEFAULT_AI_MODEL,
+                    BATCH_MAX_QUESTIONS, BATCH_LLM_CONCURRENCY, DEFAULT_WORKSPACE, SEARCH_MAX_RESULTS,
+                    ENABLE_INGEST_SUMMARY, SUMMARY_MODEL, SUMMARY_WORKERS, MAINTENANCE_INTERVAL_SECONDS,
+                    CHUNK_SIZE, CHUNK_OVERLAP, AUTO_REINDEX_ON_STARTUP, CHAT_CANDIDATE_MIN_RESULTS,
+                    THREADPOOL_HEADROOM)
 import requests
+from anyio import to_thread
 import json
 
 # 初始化组件
 app = FastAPI(title="文档ChatGPT系统")
-document_processor = DocumentProcessor()
-vector_db = VectorDatabase()
+document_processor = DocumentProcessor(CHUNK_SIZE, CHUNK_OVERLAP)
+# 已提取文本缓存（重建索引时免去重新解析）
+text_cache = TextCache()
+document_registry = DocumentRegistry()
+# 后台摘要任务线程池
+summary_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS)
+
+# 各工作区的向量数据库按需加载
+workspaces = WorkspaceManager()
+# 清理孤立文件/文档块并压缩索引的维护任务
+maintenance_task = MaintenanceTask(workspaces, document_registry, text_cache=text_cache)
+# 各处理阶段的并发与排队限制
+admission = AdmissionController()
+# 嵌入模型或分块参数变化后的后台索引重建
+reindexer = Reindexer(workspaces, text_cache, limiter=admission.embedding)
+# 服务端对话会话（追问时复用上文检索到的文档块）
+chat_sessions = ChatSessionStore()
+
+
+# 服务启动时间（模型列表的Last-Modified）
+SERVICE_STARTED_AT = time.time()
+
+
+def is_not_modified(request: Request, etag: str, last_modified: float) -> bool:
+    """根据If-None-Match/If-Modified-Since判断客户端缓存是否仍然有效"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(last_modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+def conditional_response(request: Request, payload_factory, etag: str, last_modified: float) -> Response:
+    """带ETag/Last-Modified的响应，客户端缓存仍有效时返回304且不生成响应内容"""
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(last_modified, usegmt=True),
+        "Cache-Control": "no-cache"
+    }
+    if is_not_modified(request, etag, last_modified):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(payload_factory(), headers=headers)
+
+
+@contextmanager
+def use_vector_db(workspace: str):
+    """在with块内占用工作区对应的向量数据库（占用期间不会被释放），名称无效时返回400"""
+    if not WORKSPACE_NAME_PATTERN.match(workspace):
+        raise HTTPException(status_code=400, detail=f"无效的工作区名称: {workspace}")
+    with workspaces.use(workspace) as vector_db:
+        yield vector_db
+
+
+def workspace_db(workspace: str = DEFAULT_WORKSPACE):
+    """接口依赖：请求处理期间占用工作区的向量数据库"""
+    with use_vector_db(workspace) as vector_db:
+        yield vector_db
 
 
 # AI客户端基类
@@ -27,17 +109,43 @@ class AIClient:
         self.api_url = model_config["api_url"]
         self.model_name = model_config["model_name"]
 
-    def generate_answer(self, question: str, context: str) -> str:
-        """生成答案的通用方法，子类需要实现"""
+    def generate_answer(self, question: str, context: str, history: str = "") -> str:
+        """生成答案的通用方法，子类需要实现（history为压缩后的对话历史）"""
         raise NotImplementedError("子类必须实现此方法")
 
+    def summarize(self, text: str, instruction: str) -> str:
+        """按指令概括文本（用于生成文档摘要），出错时抛出异常"""
+        prompt = f"""文档内容：
+{text}
+{instruction}"""
+        payload = {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.1,
+            "max_tokens": 1500
+        }
+        response = requests.post(
+            self.api_url,
+            headers=self.headers,
+            json=payload,
+            timeout=60
+        )
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
 
 # DeepSeek客户端
 class DeepSeekClient(AIClient):
-    def generate_answer(self, question: str, context: str) -> str:
+    def generate_answer(self, question: str, context: str, history: str = "") -> str:
         """使用DeepSeek生成答案"""
+        history_section = f"对话历史：\n{history}\n" if history else ""
         prompt = f"""基于以下文档内容，回答用户的问题。如果文档中没有相关信息，请如实告知。
-文档内容：
+{history_section}文档内容：
 {context}
 用户问题：{question}
 请基于文档内容提供准确、有用的回答："""
@@ -73,10 +181,11 @@ class DeepSeekClient(AIClient):
 
 # 智谱AI客户端
 class ZhipuAIClient(AIClient):
-    def generate_answer(self, question: str, context: str) -> str:
+    def generate_answer(self, question: str, context: str, history: str = "") -> str:
         """使用智谱AI生成答案"""
+        history_section = f"对话历史：\n{history}\n" if history else ""
         prompt = f"""基于以下文档内容，回答用户的问题。如果文档中没有相关信息，请如实告知。
-文档内容：
+{history_section}文档内容：
 {context}
 用户问题：{question}
 请基于文档内容提供准确、有用的回答："""
@@ -142,6 +251,164 @@ app.add_middleware(
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 未找到相关内容时的统一回复
+NOT_FOUND_ANSWER = "抱歉，在已上传的文档中没有找到相关信息。请尝试上传相关文档或换一个问题。"
+
+
+class BatchChatRequest(BaseModel):
+    """批量问答请求体"""
+    questions: List[str]
+    model: str = DEFAULT_AI_MODEL
+    workspace: str = DEFAULT_WORKSPACE
+    stream: bool = False  # 为True时按完成顺序以NDJSON流式返回
+    # 检索范围（与/chat的同名参数含义一致）
+    sources: Optional[List[str]] = None
+    document_ids: Optional[List[str]] = None
+    file_types: Optional[List[str]] = None
+    uploaded_after: Optional[float] = None
+    uploaded_before: Optional[float] = None
+
+
+def build_context(search_results: List[Tuple[str, Dict]]) -> str:
+    """将检索结果拼接为大模型上下文"""
+    return "\n\n".join([f"来源: {result[1]['source']}\n内容: {result[0]}"
+                        for result in search_results])
+
+
+def select_relevant(scored_results: List[Tuple[str, Dict, float]],
+                    max_distance: Optional[float]) -> List[Tuple[str, Dict]]:
+    """按相关性阈值（由语料校准）和分数差筛选检索结果，全部不相关时返回空列表（不再调用大模型）"""
+    relevant = filter_by_relevance(scored_results, max_distance)
+    if scored_results and not relevant:
+        print(f"检索到的 {len(scored_results)} 个文档块均未达到相关性阈值，跳过大模型调用")
+    return [(doc, metadata) for doc, metadata, _ in relevant]
+
+
+def build_document_summary(document_id: str, texts: List[str]):
+    """后台任务：分层生成文档摘要并写入文档登记表"""
+    try:
+        document_registry.update(document_id, summary_status="running")
+        ai_client = AIClientFactory.create_client(SUMMARY_MODEL)
+
+        def summarize(text: str, instruction: str) -> str:
+            # 后台任务并发已由线程池控制，排队等待而不是被拒绝
+            with admission.llm(SUMMARY_MODEL).acquire(BULK, blocking=True):
+                return ai_client.summarize(text, instruction)
+
+        summary = summarize_chunks(summarize, texts)
+        if document_registry.update(document_id, summary=summary, summary_status="ready"):
+            print(f"文档 {document_id} 摘要生成完成")
+    except Exception as e:
+        print(f"生成文档 {document_id} 摘要时出错: {str(e)}")
+        document_registry.update(document_id, summary_status="failed", summary_error=str(e))
+
+
+def find_workspace_document(workspace: str, document_id: str) -> Optional[Dict]:
+    """按document_id查找文档登记信息，不属于该工作区时视为不存在"""
+    record = document_registry.get(document_id)
+    return record if record and record.get("workspace", DEFAULT_WORKSPACE) == workspace else None
+
+
+def find_scoped_document(workspace: str, sources: Optional[List[str]],
+                         document_ids: Optional[List[str]]) -> Optional[Dict]:
+    """问题限定在单个文档时返回其登记信息"""
+    if document_ids and len(document_ids) == 1 and not sources:
+        return find_workspace_document(workspace, document_ids[0])
+    if sources and len(sources) == 1 and not document_ids:
+        return document_registry.find(workspace, urllib.parse.unquote(sources[0]))
+    return None
+
+
+def answer_question(ai_client: AIClient, question: str, search_results: List[Tuple[str, Dict]], model: str,
+                    priority: int = INTERACTIVE, history: str = "", blocking: bool = False) -> dict:
+    """根据检索结果生成回答，返回与/chat一致的结构
+
+    blocking为True时排队等待大模型并发名额而不是被拒绝（用于并发已受控的批量任务）。
+    """
+    if not search_results:
+        return {
+            "answer": NOT_FOUND_ANSWER,
+            "sources": [],
+            "relevant_chunks": 0,
+            "model_used": model
+        }
+    context = build_context(search_results)
+    print(f"使用 {len(search_results)} 个相关文档块生成回答...")
+    with admission.llm(model).acquire(priority, blocking=blocking):
+        answer = ai_client.generate_answer(question, context, history)
+    # 提取来源信息
+    sources = list(set([result[1]['source'] for result in search_results]))
+    return {
+        "answer": answer,
+        "sources": sources,
+        "relevant_chunks": len(search_results),
+        "model_used": model
+    }
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    """排队已满时快速返回429，提示客户端稍后重试"""
+    print(f"请求被拒绝: {exc}")
+    return JSONResponse(status_code=429, content={"detail": str(exc), "stage": exc.stage},
+                        headers={"Retry-After": str(exc.retry_after)})
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """各处理阶段的并发、排队深度和等待时间，同步接口线程池的占用，以及编码进程池的吞吐和对话会话统计"""
+    statistics = to_thread.current_default_thread_limiter().statistics()
+    threadpool = {
+        "total": statistics.total_tokens,
+        "busy": statistics.borrowed_tokens,
+        "waiting": statistics.tasks_waiting  # 在线程池外排队、尚未进入各阶段限制的请求
+    }
+    return {"stages": admission.metrics(), "threadpool": threadpool, "encode_pools": encode_pool_reports(),
+            "chat_sessions": chat_sessions.metrics()}
+
+
+@app.on_event("startup")
+async def start_maintenance():
+    """启动后台维护线程，并为索引参数已变化的工作区启动重建"""
+    # 同步接口在线程池中执行，排队等待的请求也占用线程：线程数须大于各阶段并发与队列之和，
+    # 否则请求会在线程池外无限排队，阶段队列永远不满，不会返回429
+    limiter = to_thread.current_default_thread_limiter()
+    limiter.total_tokens = max(limiter.total_tokens, admission.max_waiters(AI_MODELS) + THREADPOOL_HEADROOM)
+    print(f"同步接口线程池大小: {limiter.total_tokens}")
+    start_background_maintenance(maintenance_task, MAINTENANCE_INTERVAL_SECONDS)
+    if AUTO_REINDEX_ON_STARTUP:
+        started = reindexer.start(list_workspaces())
+        if started:
+            print(f"已启动索引重建: {started}")
+
+
+@app.on_event("shutdown")
+def stop_encode_pools():
+    """服务停止时关闭编码进程池的工作进程"""
+    close_encode_pools()
+
+
+@app.post("/reindex")
+def start_reindex(workspace: Optional[str] = None):
+    """按当前配置在后台重建索引（不指定工作区时检查全部工作区）"""
+    targets = [workspace] if workspace else list_workspaces()
+    return {"started": reindexer.start(targets)}
+
+
+@app.get("/reindex/status")
+async def get_reindex_status():
+    """各工作区的索引重建进度"""
+    return {"workspaces": reindexer.status()}
+
+
+@app.post("/maintenance/run")
+def run_maintenance(dry_run: bool = False, compact: bool = True):
+    """立即执行一次维护，返回清理报告"""
+    try:
+        return maintenance_task.run(dry_run=dry_run, compact=compact)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
 
 @app.get("/")
 async def root():
@@ -149,8 +416,11 @@ async def root():
 
 
 @app.post("/upload")
-async def upload_document(file: UploadFile = File(...)):
-    """上传文档接口"""
+def upload_document(file: UploadFile = File(...), workspace: str = DEFAULT_WORKSPACE,
+                    summarize: bool = ENABLE_INGEST_SUMMARY,
+                    vector_db: VectorDatabase = Depends(workspace_db)):
+    """上传文档接口（解析和嵌入计算属于批量任务，排队已满时返回429）"""
+    file_path = None
     try:
         print(f"收到文件上传请求: {file.filename}")
         # 解码URL编码的文件名
@@ -167,30 +437,82 @@ async def upload_document(file: UploadFile = File(...)):
         file_id = str(uuid.uuid4())
         file_path = os.path.join(UPLOAD_FOLDER, f"{file_id}{file_ext}")
         with open(file_path, "wb") as f:
-            content = await file.read()
+            content = file.file.read()
             f.write(content)
         print(f"文件保存到: {file_path}")
 
-        # 处理文档
-        chunks = document_processor.process_document(file_path, 原始文件名)
-        # 添加到向量数据库
-        vector_db.add_documents(chunks)
+        with admission.embedding.acquire(BULK):
+            # 提取文本并缓存，重建索引时无需重新解析
+            print(f"处理文档: {file_path}, 类型: {file_ext}, 原始文件名: {原始文件名}")
+            text = document_processor.extract_text(file_path)
+            text_cache.put(file_id, text)
+            # 按当前生效索引的分块参数分块（重建索引前配置可能已修改），
+            # 记录document_id和上传时间，便于按文档/时间范围检索
+            uploaded_at = int(time.time())
+            index = vector_db.index
+            processor = DocumentProcessor(index["chunk_size"], index["chunk_overlap"])
+            chunks = processor.chunk_text(
+                text, 原始文件名, file_ext,
+                extra_metadata={"document_id": file_id, "uploaded_at": uploaded_at}
+            )
+            # 添加到向量数据库
+            vector_db.add_documents(chunks)
+
+        # 登记文档，按需在后台生成摘要
+        summary_status = "pending" if summarize else "disabled"
+        document_registry.register(
+            file_id,
+            filename=原始文件名,
+            file_ext=file_ext,
+            file_path=file_path,
+            workspace=workspace,
+            uploaded_at=uploaded_at,
+            chunks_count=len(chunks),
+            summary_status=summary_status
+        )
+        if summarize:
+            summary_executor.submit(build_document_summary, file_id, [chunk[0] for chunk in chunks])
 
         return {
             "message": "文档上传成功",
             "filename": 原始文件名,
             "chunks_count": len(chunks),
             "document_id": file_id,
-            "file_ext": file_ext  # 新增：返回文件扩展名
+            "file_ext": file_ext,  # 新增：返回文件扩展名
+            "summary_status": summary_status
         }
     except Exception as e:
+        # 入库失败时删除已保存的文件和文本缓存，避免留下孤立文件
+        if file_path and os.path.exists(file_path):
+            os.remove(file_path)
+            text_cache.delete(file_id)
+        if isinstance(e, (HTTPException, AdmissionRejected)):
+            raise
         print(f"处理文档时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"处理文档时出错: {str(e)}")
 
 
 @app.post("/chat")
-async def chat_with_document(question: str, model: str = DEFAULT_AI_MODEL):
-    """与文档对话接口"""
+def chat_with_document(question: str, model: str = DEFAULT_AI_MODEL,
+                       sources: Optional[List[str]] = Query(None),
+                       document_ids: Optional[List[str]] = Query(None),
+                       file_types: Optional[List[str]] = Query(None),
+                       uploaded_after: Optional[float] = None,
+                       uploaded_before: Optional[float] = None,
+                       workspace: str = DEFAULT_WORKSPACE,
+                       session_id: Optional[str] = None,
+                       vector_db: VectorDatabase = Depends(workspace_db)):
+    """与文档对话接口（可按文档名、document_id、文件类型、上传时间范围限定检索范围）
+
+    提供session_id时在服务端保存对话：追问按上文拼接查询，优先在上文检索到的文档块中重新排序，
+    相关块不足时再全量检索；非追问的问题始终全量检索。提示词中附带压缩后的对话历史。
+    """
+    session = None
+    if session_id:
+        try:
+            session = chat_sessions.get(session_id, workspace)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
     try:
         print(f"收到问题: {question}, 使用模型: {model}")
         if not question.strip():
@@ -202,69 +524,191 @@ async def chat_with_document(question: str, model: str = DEFAULT_AI_MODEL):
         except ValueError as e:
             raise HTTPException(status_code=400, detail=f"不支持的AI模型: {model}")
 
-        # 搜索相关文档片段
-        search_results = vector_db.search(question, n_results=5)
-        if not search_results:
-            return {
-                "answer": "抱歉，在已上传的文档中没有找到相关信息。请尝试上传相关文档或换一个问题。",
-                "sources": [],
-                "relevant_chunks": 0,
-                "model_used": model
-            }
-
-        # 构建上下文
-        context = "\n\n".join([f"来源: {result[1]['source']}\n内容: {result[0]}"
-                               for result in search_results])
-        print(f"使用 {len(search_results)} 个相关文档块生成回答...")
-
-        # 生成回答
-        answer = ai_client.generate_answer(question, context)
-
-        # 提取来源信息
-        sources = list(set([result[1]['source'] for result in search_results]))
-        return {
-            "answer": answer,
-            "sources": sources,
-            "relevant_chunks": len(search_results),
-            "model_used": model
-        }
+        where = build_where_filter(sources, document_ids, file_types, uploaded_after, uploaded_before)
+        scope = json.dumps(where, sort_keys=True)
+
+        # 限定单个文档的概述类问题直接使用预先生成的摘要
+        if is_summary_question(question):
+            record = find_scoped_document(workspace, sources, document_ids)
+            if record and record.get("summary_status") == "ready":
+                print(f"使用文档 {record['document_id']} 的预生成摘要回答")
+                if session:
+                    session.record_turn(question, record["summary"], [record["filename"]], [],
+                                        vector_db.etag, scope)
+                return {
+                    "answer": record["summary"],
+                    "sources": [record["filename"]],
+                    "relevant_chunks": 0,
+                    "model_used": model,
+                    "from_summary": True
+                }
+
+        # 搜索相关文档片段（范围条件下推到向量库查询）
+        if session is None:
+            with admission.vector_query.acquire(INTERACTIVE):
+                max_distance = vector_db.relevance_threshold()
+                scored_results = vector_db.search_with_scores(question, n_results=SEARCH_MAX_RESULTS, where=where)
+            search_results = select_relevant(scored_results, max_distance)
+            # 生成回答
+            return answer_question(ai_client, question, search_results, model)
+
+        # 会话内的追问：先在上文的候选块中重新排序，相关块不足时再全量检索；
+        # 其他问题直接全量检索，结果并入候选集
+        followup = is_followup(question)
+        query = session.retrieval_query(question)
+        etag = vector_db.etag
+        with admission.vector_query.acquire(INTERACTIVE):
+            max_distance = vector_db.relevance_threshold()
+            query_embedding, shards = vector_db.encode_query(query)
+            scored_results = session.rerank(query_embedding, etag, scope, SEARCH_MAX_RESULTS) if followup else []
+            reused = (len(filter_by_relevance([item[:3] for item in scored_results], max_distance))
+                      >= CHAT_CANDIDATE_MIN_RESULTS)
+            if scored_results:
+                chat_sessions.record_lookup(reused)
+            if reused:
+                print(f"会话 {session_id} 复用上文候选文档块，查询: '{query}'")
+            else:
+                print(f"搜索查询: '{query}'" + (f", 过滤条件: {where}" if where else ""))
+                scored_results = vector_db.search_by_embedding(query_embedding, shards, SEARCH_MAX_RESULTS, where)
+        search_results = select_relevant([item[:3] for item in scored_results], max_distance)
+        # 生成回答（附带本轮之前的对话历史）
+        result = answer_question(ai_client, question, search_results, model, history=session.history_text())
+        session.record_turn(question, result["answer"], result["sources"], scored_results, etag, scope,
+                            query_embedding)
+        return {**result, "session_id": session_id, "retrieval": "session_cache" if reused else "search"}
+    except (HTTPException, AdmissionRejected):
+        raise
     except Exception as e:
         print(f"生成回答时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"生成回答时出错: {str(e)}")
 
 
+@app.delete("/chat/sessions/{session_id}")
+def delete_chat_session(session_id: str):
+    """结束对话会话，释放服务端保存的历史和候选文档块"""
+    if not chat_sessions.delete(session_id):
+        raise HTTPException(status_code=404, detail="会话不存在或已过期")
+    return {"message": "会话已删除", "session_id": session_id}
+
+
+@app.post("/chat/batch")
+def chat_batch(request: BatchChatRequest):
+    """批量问答接口：一次编码、一次向量查询，并发调用大模型"""
+    questions = request.questions
+    model = request.model
+    print(f"收到批量问题: {len(questions)} 个, 使用模型: {model}")
+    if not questions:
+        raise HTTPException(status_code=400, detail="问题列表不能为空")
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        raise HTTPException(status_code=400, detail=f"单次最多支持 {BATCH_MAX_QUESTIONS} 个问题")
+    try:
+        ai_client = AIClientFactory.create_client(model)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"不支持的AI模型: {model}")
+
+    try:
+        where = build_where_filter(request.sources, request.document_ids, request.file_types,
+                                   request.uploaded_after, request.uploaded_before)
+        with use_vector_db(request.workspace) as vector_db, admission.vector_query.acquire(BULK):
+            max_distance = vector_db.relevance_threshold()
+            scored_batch = vector_db.search_batch_with_scores(questions, n_results=SEARCH_MAX_RESULTS, where=where)
+        batch_results = [select_relevant(results, max_distance) for results in scored_batch]
+    except (HTTPException, AdmissionRejected):
+        raise
+    except Exception as e:
+        print(f"批量检索时出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"批量检索时出错: {str(e)}")
+
+    def answer_one(index: int) -> dict:
+        question = questions[index]
+        if not question.strip():
+            return {"index": index, "question": question, "error": "问题不能为空"}
+        # 批量问答的并发已由BATCH_LLM_CONCURRENCY限制，排队等待大模型名额而不是逐题返回繁忙
+        result = answer_question(ai_client, question, batch_results[index], model, priority=BULK, blocking=True)
+        return {"index": index, "question": question, **result}
+
+    executor = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY)
+    futures = [executor.submit(answer_one, i) for i in range(len(questions))]
+
+    if request.stream:
+        def stream_results():
+            try:
+                for future in as_completed(futures):
+                    yield json.dumps(future.result(), ensure_ascii=False) + "\n"
+            finally:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+    try:
+        results = [future.result() for future in futures]
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return {"results": results, "model_used": model}
+
+
 @app.get("/models")
-async def get_available_models():
-    """获取可用的AI模型列表"""
-    return {
+async def get_available_models(request: Request):
+    """获取可用的AI模型列表（支持条件请求）"""
+    payload = {
         "available_models": list(AI_MODELS.keys()),
         "default_model": DEFAULT_AI_MODEL
     }
+    etag = '"' + hashlib.md5(json.dumps(payload).encode("utf-8")).hexdigest() + '"'
+    return conditional_response(request, lambda: payload, etag, SERVICE_STARTED_AT)
 
 
 @app.get("/documents")
-async def get_documents():
-    """获取所有已上传的文档列表"""
+async def get_documents(request: Request, vector_db: VectorDatabase = Depends(workspace_db)):
+    """获取所有已上传的文档列表（支持条件请求，语料未变化时返回304）"""
     try:
-        documents = vector_db.get_all_documents()
-        return {"documents": documents}
+        etag = vector_db.etag
+        return conditional_response(
+            request,
+            lambda: {"documents": vector_db.get_all_documents(), "version": etag.strip('"')},
+            etag,
+            vector_db.last_modified
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取文档列表时出错: {str(e)}")
 
 
 @app.delete("/documents/{filename}")
-async def delete_document(filename: str):
+def delete_document(filename: str, workspace: str = DEFAULT_WORKSPACE,
+                    vector_db: VectorDatabase = Depends(workspace_db)):
     """删除指定文档"""
     try:
         vector_db.delete_document(filename)
+        # 同时删除原始上传文件
+        for record in document_registry.remove(workspace, urllib.parse.unquote(filename)):
+            file_path = record.get("file_path")
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+                print(f"已删除上传文件: {file_path}")
+            text_cache.delete(record["document_id"])
         return {"message": f"文档 {filename} 已删除"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"删除文档时出错: {str(e)}")
 
 
+@app.get("/documents/{document_id}/summary")
+async def get_document_summary(document_id: str, workspace: str = DEFAULT_WORKSPACE):
+    """获取指定文档的预生成摘要"""
+    record = find_workspace_document(workspace, urllib.parse.unquote(document_id))
+    if not record:
+        raise HTTPException(status_code=404, detail="文档不存在")
+    return {
+        "document_id": record["document_id"],
+        "filename": record.get("filename"),
+        "summary_status": record.get("summary_status", "disabled"),
+        "summary": record.get("summary"),
+        "error": record.get("summary_error")
+    }
+
+
 @app.get("/documents/{document_id}/content")
-async def get_document_content(document_id: str):
-    """获取指定文档的内容"""
+async def get_document_content(document_id: str, workspace: str = DEFAULT_WORKSPACE):
+    """获取指定文档的内容（只能读取该工作区登记的文档）"""
     try:
         # 调试：打印原始输入的document_id
         print(f"\n===== 开始获取文档内容 =====")
@@ -274,27 +718,11 @@ async def get_document_content(document_id: str):
         decoded_id = urllib.parse.unquote(document_id)
         print(f"解码后的document_id: {decoded_id} (类型: {type(decoded_id)})")
 
-        # 查找对应的文件
-        file_path = None
-        file_ext = None
-        print(f"开始在目录 {UPLOAD_FOLDER} 中查找文件...")
-
-        # 调试：列出目录中所有文件，确认文件是否存在
-        try:
-            all_files = os.listdir(UPLOAD_FOLDER)
-            print(f"上传目录文件列表: {all_files} (共 {len(all_files)} 个文件)")
-        except Exception as e:
-            print(f"读取上传目录失败: {str(e)} (可能是目录不存在或权限问题)")
-            raise  # 继续抛出异常
-
-        # 遍历文件查找匹配项
-        for file in all_files:
-            print(f"检查文件: {file} (是否以 {decoded_id} 开头: {file.startswith(decoded_id)})")
-            if file.startswith(decoded_id):
-                file_path = os.path.join(UPLOAD_FOLDER, file)
-                file_ext = os.path.splitext(file)[1].lower()
-                print(f"找到匹配文件: {file_path}, 扩展名: {file_ext}")
-                break
+        # 按登记表查找对应的文件（不按文件名前缀匹配，避免读到其他工作区的文档）
+        record = find_workspace_document(workspace, decoded_id)
+        file_path = record.get("file_path") if record else None
+        file_ext = os.path.splitext(file_path)[1].lower() if file_path else None
+        print(f"工作区 {workspace} 中的登记文件: {file_path}, 扩展名: {file_ext}")
 
         # 检查文件路径是否有效
         print(f"最终确定的file_path: {file_path}")
@@ -0,0 +1,67 @@
+import os
+import time
+import argparse
+import tempfile
+import tracemalloc
+from docx import Document
+from document_processor import DocumentProcessor
+
+
+def read_docx_python_docx(file_path: str) -> str:
+    """原python-docx读取方式（加载完整对象模型，只读取段落）"""
+    text = ""
+    doc = Document(file_path)
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            text += paragraph.text + "\n"
+    return text
+
+
+def build_test_docx(file_path: str, paragraphs: int, tables: int, rows: int):
+    """生成包含段落和表格的测试文档"""
+    doc = Document()
+    for t in range(tables):
+        for p in range(paragraphs // max(tables, 1)):
+            doc.add_paragraph(f"第{t}节第{p}段：这是用于性能测试的中文段落内容，包含一些说明文字。" * 3)
+        table = doc.add_table(rows=rows, cols=4)
+        for r, row in enumerate(table.rows):
+            for c, cell in enumerate(row.cells):
+                cell.text = f"参数{t}-{r}-{c}"
+    doc.save(file_path)
+
+
+def measure(name: str, reader, file_path: str):
+    """测量读取耗时和峰值内存（reader返回文本或块数）"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = reader(file_path)
+    size = result if isinstance(result, int) else len(result)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<14} 耗时: {elapsed:8.3f}s  峰值内存: {peak / 1024 / 1024:8.1f}MB  输出长度: {size}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="DOCX读取性能对比")
+    parser.add_argument("--file", help="使用已有的docx文件，不指定则生成测试文档")
+    parser.add_argument("--paragraphs", type=int, default=20000)
+    parser.add_argument("--tables", type=int, default=200)
+    parser.add_argument("--rows", type=int, default=50)
+    args = parser.parse_args()
+
+    file_path = args.file
+    if not file_path:
+        file_path = os.path.join(tempfile.mkdtemp(), "benchmark.docx")
+        print(f"正在生成测试文档: {args.paragraphs} 段落, {args.tables} 个表格 x {args.rows} 行...")
+        build_test_docx(file_path, args.paragraphs, args.tables, args.rows)
+    print(f"文档大小: {os.path.getsize(file_path) / 1024 / 1024:.1f}MB")
+
+    processor = DocumentProcessor()
+    measure("python-docx", read_docx_python_docx, file_path)
+    measure("流式读取", processor.read_docx, file_path)
+    # 只遍历不拼接，体现读取器本身的内存占用
+    measure("流式逐块遍历", lambda path: sum(1 for _ in processor.iter_docx_blocks(path)), file_path)
+
+    if not args.file:
+        os.remove(file_path)
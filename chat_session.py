@@ -0,0 +1,158 @@
+import re
+import time
+import threading
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+from config import (CHAT_SESSION_MAX_SESSIONS, CHAT_SESSION_TTL_SECONDS, CHAT_SESSION_MAX_TURNS,
+                    CHAT_SESSION_MAX_CANDIDATES, CHAT_FOLLOWUP_MAX_DISTANCE, CHAT_QUERY_TURNS,
+                    CHAT_HISTORY_TURNS, CHAT_HISTORY_ANSWER_CHARS)
+from vector_db import embedding_distance
+
+# 会话ID只允许字母、数字、下划线和短横线
+SESSION_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 指代上文的追问特征：以指代词/承接词开头，或以“呢”结尾
+FOLLOWUP_PATTERN = re.compile(r"^(那|这|它|其|该|上述|上面|刚才|前面|还有|另外|继续|具体)|呢[？?]?$")
+
+
+def is_followup(question: str) -> bool:
+    """判断问题是否依赖上文（以指代/承接词开头，或以“呢”结尾）"""
+    return bool(FOLLOWUP_PATTERN.search(question.strip()))
+
+
+class ChatSession:
+    """单个对话会话：最近几轮问答，以及这些轮次检索到的候选文档块（含向量）
+
+    候选块只用于追问，且要求本轮查询与上一轮查询的向量足够接近；语料版本(etag)或检索范围变化后自动失效。
+    """
+
+    def __init__(self, session_id: str, workspace: str):
+        self.session_id = session_id
+        self.workspace = workspace
+        self.turns = deque(maxlen=CHAT_SESSION_MAX_TURNS)
+        # 块id -> (文档, 元数据, 块向量)，按最近使用排序
+        self._candidates: "OrderedDict[str, Tuple[str, Dict, List[float]]]" = OrderedDict()
+        self._candidates_etag: Optional[str] = None
+        self._candidates_scope: Optional[str] = None
+        # 上一轮检索查询的向量
+        self._last_query_embedding: Optional[List[float]] = None
+        self.last_used = time.time()
+        self._lock = threading.Lock()
+
+    def retrieval_query(self, question: str) -> str:
+        """检索用的查询：追问时拼接最近几轮的问题，否则直接使用原问题"""
+        with self._lock:
+            previous = [turn["question"] for turn in list(self.turns)[-CHAT_QUERY_TURNS:]]
+        if not previous or not is_followup(question):
+            return question
+        return " ".join(previous + [question])
+
+    def history_text(self) -> str:
+        """压缩后的对话历史（最近几轮，回答截断），用于提示词"""
+        with self._lock:
+            turns = list(self.turns)[-CHAT_HISTORY_TURNS:]
+        lines = []
+        for turn in turns:
+            answer = turn["answer"]
+            if len(answer) > CHAT_HISTORY_ANSWER_CHARS:
+                answer = answer[:CHAT_HISTORY_ANSWER_CHARS] + "…"
+            lines.append(f"用户：{turn['question']}\n助手：{answer}")
+        return "\n".join(lines)
+
+    def rerank(self, query_embedding: List[float], etag: str, scope: str,
+               n_results: int) -> List[Tuple[str, Dict, float, str, List[float]]]:
+        """用查询向量对缓存的候选块重新排序；候选已失效或查询与上一轮差异过大时返回空列表"""
+        with self._lock:
+            if self._candidates_etag != etag or self._candidates_scope != scope:
+                return []
+            last = self._last_query_embedding
+            if last is None or embedding_distance(query_embedding, last) > CHAT_FOLLOWUP_MAX_DISTANCE:
+                return []
+            candidates = list(self._candidates.items())
+        scored = [(doc, metadata, embedding_distance(query_embedding, embedding), chunk_id, embedding)
+                  for chunk_id, (doc, metadata, embedding) in candidates]
+        scored.sort(key=lambda item: item[2])
+        return scored[:n_results]
+
+    def record_turn(self, question: str, answer: str, sources: List[str],
+                    results: List[Tuple[str, Dict, float, str, List[float]]], etag: str, scope: str,
+                    query_embedding: Optional[List[float]] = None):
+        """记录一轮问答，并把本轮检索到的块加入候选集（超出上限时淘汰最久未使用的块）"""
+        with self._lock:
+            self.turns.append({"question": question, "answer": answer, "sources": sources})
+            self._last_query_embedding = query_embedding
+            if self._candidates_etag != etag or self._candidates_scope != scope:
+                self._candidates.clear()
+                self._candidates_etag, self._candidates_scope = etag, scope
+            for doc, metadata, _, chunk_id, embedding in results:
+                self._candidates[chunk_id] = (doc, metadata, embedding)
+                self._candidates.move_to_end(chunk_id)
+            while len(self._candidates) > CHAT_SESSION_MAX_CANDIDATES:
+                self._candidates.popitem(last=False)
+
+    def candidate_count(self) -> int:
+        with self._lock:
+            return len(self._candidates)
+
+
+class ChatSessionStore:
+    """对话会话存储：超过TTL未使用的会话过期，超出数量上限时淘汰最久未使用的会话"""
+
+    def __init__(self, max_sessions: int = CHAT_SESSION_MAX_SESSIONS,
+                 ttl: float = CHAT_SESSION_TTL_SECONDS):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._lock = threading.Lock()
+        # 统计信息
+        self._cache_hits = 0
+        self._cache_misses = 0
+
+    def get(self, session_id: str, workspace: str) -> ChatSession:
+        """获取会话（不存在、已过期或工作区不同时新建），会话ID无效时抛出ValueError"""
+        if not SESSION_ID_PATTERN.match(session_id):
+            raise ValueError(f"无效的会话ID: {session_id}")
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            session = self._sessions.get(session_id)
+            if session is None or session.workspace != workspace:
+                session = ChatSession(session_id, workspace)
+                self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            session.last_used = now
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _evict_expired(self, now: float):
+        # 会话按最近使用排序，从最旧的开始检查
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if now - session.last_used <= self.ttl:
+                break
+            del self._sessions[session_id]
+
+    def record_lookup(self, hit: bool):
+        """记录一次候选块复用是否命中"""
+        with self._lock:
+            if hit:
+                self._cache_hits += 1
+            else:
+                self._cache_misses += 1
+
+    def metrics(self) -> Dict:
+        with self._lock:
+            self._evict_expired(time.time())
+            lookups = self._cache_hits + self._cache_misses
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "candidate_hits": self._cache_hits,
+                "candidate_misses": self._cache_misses,
+                "candidate_hit_rate": round(self._cache_hits / lookups, 3) if lookups else 0.0
+            }
@@ -21,14 +21,103 @@ DEFAULT_AI_MODEL = "deepseek"
 VECTOR_DB_PATH = "./chroma_db"
 EMBEDDING_MODEL = "BAAI/bge-small-zh"  # 中文优化的embedding模型
 
+# 工作区（租户）配置：每个工作区使用独立的向量库目录，默认工作区沿用VECTOR_DB_PATH
+DEFAULT_WORKSPACE = "default"
+WORKSPACE_DB_ROOT = "./chroma_workspaces"
+SHARDS_PER_WORKSPACE = 1  # 工作区内按文档哈希分片数（已有数据后不要修改）
+SHARD_QUERY_CONCURRENCY = 4  # 跨分片并行查询的线程数
+MAX_LOADED_WORKSPACES = 16  # 同时保持加载的工作区数量上限
+WORKSPACE_IDLE_SECONDS = 1800  # 工作区空闲超过该时间后释放
+
+# 检索相关性配置（距离越小越相关；RELEVANCE_MAX_DISTANCE设为None时不做阈值过滤）
+# 距离为归一化向量的平方L2距离（= 2 - 2×余弦相似度）。bge系列模型的相似度普遍集中在0.6~1之间，
+# 固定阈值无法区分无关问题，因此实际阈值按各工作区语料校准：用下面一组与文档无关的探测问题检索语料，
+# 取其最相关块距离的低分位数（正常问题的最相关块应比大部分无关问题更近），语料变化后重新校准并打印日志
+SEARCH_MAX_RESULTS = 8  # 单次检索最多取回的文档块数
+RELEVANCE_MAX_DISTANCE = 0.8  # 距离上限（未经校准的宽松值，只作为校准结果的上限和语料为空时的取值）
+RELEVANCE_PROBE_PERCENTILE = 0.25  # 取探测问题最相关块距离的分位数作为阈值（容忍少数探测问题恰好与语料相关）
+RELEVANCE_PROBE_QUESTIONS = [
+    "今天天气怎么样？",
+    "红烧肉怎么做？",
+    "推荐几部好看的电影",
+    "世界上最高的山是哪座？",
+    "如何学习弹吉他？",
+    "猫为什么喜欢晒太阳？",
+    "足球比赛一场多长时间？",
+    "明天去海边需要带什么？",
+    "怎样种好多肉植物？",
+    "给我讲个笑话",
+    "月亮离地球有多远？",
+    "周末去哪里爬山比较好？",
+]
+RELEVANCE_SCORE_GAP = 0.15  # 与最相关块的距离差超过该值后不再追加文档块
+
 # 文档处理配置
 CHUNK_SIZE = 500  # 文本块大小
 CHUNK_OVERLAP = 50  # 文本块重叠大小
 
+# 批量问答配置
+BATCH_MAX_QUESTIONS = 500  # 单次批量请求最多问题数
+BATCH_LLM_CONCURRENCY = 8  # 批量问答时并发调用大模型的上限
+
+# 文档摘要配置（上传时在后台用大模型分层生成摘要）
+ENABLE_INGEST_SUMMARY = False  # 上传接口summarize参数的默认值（开启后每次上传会额外调用多次大模型）
+SUMMARY_MODEL = DEFAULT_AI_MODEL  # 生成摘要使用的模型
+SUMMARY_GROUP_CHARS = 6000  # 每次交给大模型概括的最大字符数
+SUMMARY_WORKERS = 2  # 后台摘要任务的并发数
+
+# 文档登记表（记录上传文档信息与摘要）
+DOCUMENT_REGISTRY_PATH = "./data/documents.json"
+
+# 后台维护配置（清理孤立文件/文档块，压缩向量索引）
+MAINTENANCE_INTERVAL_SECONDS = 6 * 3600  # 后台维护间隔，设为0关闭
+MAINTENANCE_GRACE_SECONDS = 3600  # 新上传文件在该时间内不会被当作孤立文件清理
+MAINTENANCE_BATCH_SIZE = 500  # 每批扫描/复制的文档块数
+MAINTENANCE_PAUSE_SECONDS = 0.05  # 每批之间的暂停，避免影响查询延迟
+MAINTENANCE_NICE = 10  # 维护线程的调度优先级（nice值，仅Linux生效）
+MAINTENANCE_VACUUM_MIN_FREE_BYTES = 64 * 1024 * 1024  # SQLite空闲页超过该大小时执行VACUUM（需要约同等大小的临时磁盘空间）
+COMPACTION_TOMBSTONE_RATIO = 0.2  # 已删除块占比超过该值时压缩分片
+COMPACTION_MIN_TOMBSTONES = 1000  # 已删除块数少于该值时不压缩
+
+# 并发与排队限制（超出并发的请求排队，队列满或等待超时返回429）
+ADMISSION_MAX_WAIT_SECONDS = 20  # 最长排队时间
+EMBEDDING_CONCURRENCY = 2  # 上传入库时同时生成嵌入向量的请求数
+EMBEDDING_QUEUE_SIZE = 8
+VECTOR_QUERY_CONCURRENCY = 8  # 同时进行的向量检索数
+VECTOR_QUERY_QUEUE_SIZE = 64
+LLM_CONCURRENCY = {"deepseek": 8, "zhipu": 4}  # 各大模型服务商的并发调用上限
+LLM_DEFAULT_CONCURRENCY = 4
+LLM_QUEUE_SIZE = 32
+THREADPOOL_HEADROOM = 40  # 同步接口线程池在各阶段并发与队列之和之外预留的线程数（其他同步接口使用）
+
+# 重建索引配置（EMBEDDING_MODEL或CHUNK_SIZE/CHUNK_OVERLAP变化后在后台重建，完成后原子切换）
+TEXT_CACHE_FOLDER = "./data/text_cache"  # 已提取文本缓存目录
+AUTO_REINDEX_ON_STARTUP = True  # 启动时检查各工作区的索引参数并自动重建
+REINDEX_BATCH_SIZE = 64  # 每批写入新索引的文档块数（超过ENCODE_BATCH_SIZE块的文档使用编码进程池）
+
+# 嵌入编码进程池（CPU机器上大批量入库时使用多进程编码）
+ENCODE_POOL_WORKERS = None  # 工作进程数，None时按CPU核数/每进程线程数计算，0表示不使用进程池
+ENCODE_THREADS_PER_WORKER = 2  # 每个工作进程的计算线程数
+ENCODE_BATCH_SIZE = 32  # 每批编码的文本块数
+ENCODE_POOL_MIN_TEXTS = 256  # 文本块少于该数量时直接在当前进程编码
+ENCODE_WINDOW_BATCHES = 4  # 每个工作进程每个窗口分到的批数（窗口内按长度排序）
+
+# 对话会话配置（服务端保存最近几轮的问答和检索到的文档块，用于追问；以指代/承接词开头或以“呢”结尾的问题视为追问）
+CHAT_SESSION_MAX_SESSIONS = 1000  # 最多保留的会话数，超出时淘汰最久未使用的会话
+CHAT_SESSION_TTL_SECONDS = 3600  # 会话空闲超过该时间后过期
+CHAT_SESSION_MAX_TURNS = 6  # 每个会话保留的最近轮数
+CHAT_SESSION_MAX_CANDIDATES = 48  # 每个会话缓存的候选文档块数（含向量）
+CHAT_FOLLOWUP_MAX_DISTANCE = 0.5  # 追问的查询向量与上一轮的距离（平方L2）不超过该值时才复用上文候选块
+CHAT_QUERY_TURNS = 2  # 追问检索时拼接的上文问题数
+CHAT_CANDIDATE_MIN_RESULTS = 2  # 缓存候选中相关文档块不少于该数量时不再全量检索
+CHAT_HISTORY_TURNS = 3  # 提示词中附带的历史轮数
+CHAT_HISTORY_ANSWER_CHARS = 200  # 历史回答在提示词中保留的最大字符数
+
 # 文件上传配置
 UPLOAD_FOLDER = "./data/uploaded_files"
 ALLOWED_EXTENSIONS = {'.pdf', '.docx', '.txt'}
 
 # 确保上传目录存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-os.makedirs(VECTOR_DB_PATH, exist_ok=True)
\ No newline at end of file
+os.makedirs(VECTOR_DB_PATH, exist_ok=True)
+os.makedirs(WORKSPACE_DB_ROOT, exist_ok=True)
\ No newline at end of file
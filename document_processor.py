@@ -1,9 +1,14 @@
 import os
 import PyPDF2
-from docx import Document
-from typing import List, Tuple
+import zipfile
+import xml.etree.ElementTree as ET
+from typing import List, Tuple, Iterator
 import re
 
+# Word文档XML命名空间
+W_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+MC_FALLBACK = "{http://schemas.openxmlformats.org/markup-compatibility/2006}Fallback"
+
 
 class DocumentProcessor:
     def __init__(self, chunk_size=500, chunk_overlap=50):
@@ -24,17 +29,99 @@ class DocumentProcessor:
             print(f"PDF读取错误: {e}")
         return text
 
+    def iter_docx_blocks(self, file_path: str) -> Iterator[str]:
+        """流式解析word/document.xml，按文档顺序逐个产出段落和表格行
+
+        表格行的单元格用" | "分隔，嵌套表格的行并入所在单元格。
+        已处理的段落和表格行会立即从树中移除（表格内同样逐行释放），内存占用与文档大小无关。
+        """
+        with zipfile.ZipFile(file_path) as archive:
+            with archive.open("word/document.xml") as xml_file:
+                body = None
+                paragraphs = []  # 段落栈（文本框内可嵌套段落），每项为文字片段列表
+                tables = []  # 表格栈，每项记录当前行的单元格和当前单元格的段落
+                fallback_depth = 0  # mc:Fallback内的内容与主体重复，跳过
+                stack = []  # 当前元素的祖先链，用于判断父元素和移除已处理的元素
+                for event, elem in ET.iterparse(xml_file, events=("start", "end")):
+                    tag = elem.tag
+                    if event == "start":
+                        stack.append(elem)
+                        if tag == MC_FALLBACK:
+                            fallback_depth += 1
+                        elif fallback_depth:
+                            continue
+                        elif tag == f"{W_NS}body":
+                            body = elem
+                        elif tag == f"{W_NS}p":
+                            paragraphs.append([])
+                        elif tag == f"{W_NS}tbl":
+                            tables.append({"row": [], "cell": []})
+                        elif tag == f"{W_NS}tr" and tables:
+                            tables[-1]["row"] = []
+                        elif tag == f"{W_NS}tc" and tables:
+                            tables[-1]["cell"] = []
+                        continue
+
+                    stack.pop()
+                    parent = stack[-1] if stack else None
+                    if tag == MC_FALLBACK:
+                        fallback_depth -= 1
+                        elem.clear()
+                        continue
+                    if fallback_depth:
+                        continue
+                    if tag == f"{W_NS}t":
+                        if paragraphs and elem.text:
+                            paragraphs[-1].append(elem.text)
+                        elem.clear()
+                    elif tag == f"{W_NS}tab":
+                        # 只有run内的w:tab是制表符，w:pPr/w:tabs下的是制表位定义
+                        if paragraphs and parent is not None and parent.tag == f"{W_NS}r":
+                            paragraphs[-1].append("\t")
+                    elif tag in (f"{W_NS}br", f"{W_NS}cr"):
+                        if paragraphs:
+                            paragraphs[-1].append("\n")
+                    elif tag == f"{W_NS}p" and paragraphs:
+                        paragraph = "".join(paragraphs.pop())
+                        if paragraph.strip():
+                            if tables:
+                                tables[-1]["cell"].append(paragraph.strip())
+                            else:
+                                yield paragraph
+                    elif tag == f"{W_NS}tc" and tables:
+                        tables[-1]["row"].append(" ".join(tables[-1]["cell"]))
+                    elif tag == f"{W_NS}tr" and tables:
+                        cells = tables[-1]["row"]
+                        if any(cells):
+                            row = " | ".join(cells)
+                            if len(tables) > 1:
+                                tables[-2]["cell"].append(row)
+                            else:
+                                yield row
+                    elif tag == f"{W_NS}tbl" and tables:
+                        tables.pop()
+
+                    # 段落、表格行和表格处理完毕后从父元素中移除（之前的兄弟元素均已移除，通常位于首位）
+                    if tag in (f"{W_NS}p", f"{W_NS}tr", f"{W_NS}tbl"):
+                        elem.clear()
+                        try:
+                            if parent is not None:
+                                parent.remove(elem)
+                        except ValueError:
+                            pass  # 已随body.clear()移除
+                    # 顶层段落或表格处理完毕后清空body中的其他元素（书签等），保持内存恒定
+                    if body is not None and not tables and tag in (f"{W_NS}p", f"{W_NS}tbl"):
+                        body.clear()
+
     def read_docx(self, file_path: str) -> str:
-        """读取Word文档"""
-        text = ""
+        """读取Word文档（包含表格内容）"""
+        blocks = []
         try:
-            doc = Document(file_path)
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
+            for block in self.iter_docx_blocks(file_path):
+                blocks.append(block + "\n")
         except Exception as e:
             print(f"DOCX读取错误: {e}")
-        return text
+        return "".join(blocks)
 
     def read_txt(self, file_path: str) -> str:
         """读取文本文件"""
@@ -81,12 +168,9 @@ class DocumentProcessor:
                 break
         return chunks
 
-    # 关键修改：新增original_filename参数，接收原始文件名
-    def process_document(self, file_path: str, original_filename: str = None) -> List[Tuple[str, dict]]:
-        """处理文档并返回文本块（支持原始文件名传入）"""
+    def extract_text(self, file_path: str) -> str:
+        """读取并清理文档文本"""
         file_ext = os.path.splitext(file_path)[1].lower()
-        print(f"处理文档: {file_path}, 类型: {file_ext}, 原始文件名: {original_filename}")
-
         # 读取文档
         if file_ext == '.pdf':
             text = self.read_pdf(file_path)
@@ -102,23 +186,39 @@ class DocumentProcessor:
         print(f"读取文本长度: {len(text)} 字符")
 
         # 清理文本
-        text = self.clean_text(text)
+        return self.clean_text(text)
+
+    def chunk_text(self, text: str, source: str, file_ext: str,
+                   extra_metadata: dict = None) -> List[Tuple[str, dict]]:
+        """将已清理的文本分块并添加元数据"""
         # 分割文本
         chunks = self.split_text(text)
         print(f"分割为 {len(chunks)} 个文本块")
 
-        # 为每个块添加元数据（关键修改：使用原始文件名作为source）
+        # 为每个块添加元数据
         chunks_with_metadata = []
         for i, chunk in enumerate(chunks):
             metadata = {
-                # 优先使用传入的原始文件名，否则用文件路径的basename
-                "source": original_filename if original_filename else os.path.basename(file_path),
+                "source": source,
                 "chunk_id": i,
                 "file_type": file_ext
             }
+            if extra_metadata:
+                metadata.update(extra_metadata)
             chunks_with_metadata.append((chunk, metadata))
         return chunks_with_metadata
 
+    # 关键修改：新增original_filename参数，接收原始文件名
+    def process_document(self, file_path: str, original_filename: str = None,
+                         extra_metadata: dict = None) -> List[Tuple[str, dict]]:
+        """处理文档并返回文本块（支持原始文件名传入，extra_metadata会合并到每个块的元数据中）"""
+        file_ext = os.path.splitext(file_path)[1].lower()
+        print(f"处理文档: {file_path}, 类型: {file_ext}, 原始文件名: {original_filename}")
+        text = self.extract_text(file_path)
+        # 优先使用传入的原始文件名作为source，否则用文件路径的basename
+        source = original_filename if original_filename else os.path.basename(file_path)
+        return self.chunk_text(text, source, file_ext, extra_metadata)
+
 
 # 测试文档处理
 if __name__ == "__main__":
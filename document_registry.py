@@ -0,0 +1,80 @@
+import os
+import json
+import threading
+from typing import Dict, List, Optional
+from config import DOCUMENT_REGISTRY_PATH
+
+
+class DocumentRegistry:
+    """文档登记表：记录每个已上传文档的基本信息和摘要，持久化为JSON文件"""
+
+    def __init__(self, path: str = DOCUMENT_REGISTRY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._documents: Dict[str, Dict] = {}
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._documents = json.load(f)
+        except Exception as e:
+            print(f"读取文档登记表时出错: {e}")
+            self._documents = {}
+
+    def _save_locked(self):
+        # 先写临时文件再替换，避免写入中断导致登记表损坏
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._documents, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def register(self, document_id: str, **fields):
+        """登记文档（已存在时合并字段）"""
+        with self._lock:
+            record = self._documents.setdefault(document_id, {"document_id": document_id})
+            record.update(fields)
+            self._save_locked()
+
+    def update(self, document_id: str, **fields) -> bool:
+        """更新已登记文档的字段，文档不存在时返回False"""
+        with self._lock:
+            record = self._documents.get(document_id)
+            if record is None:
+                return False
+            record.update(fields)
+            self._save_locked()
+            return True
+
+    def get(self, document_id: str) -> Optional[Dict]:
+        with self._lock:
+            record = self._documents.get(document_id)
+            return dict(record) if record else None
+
+    def find(self, workspace: str, filename: str) -> Optional[Dict]:
+        """按工作区和原始文件名查找最近上传的文档"""
+        with self._lock:
+            matches = [r for r in self._documents.values()
+                       if r.get("workspace") == workspace and r.get("filename") == filename]
+        if not matches:
+            return None
+        return dict(max(matches, key=lambda r: r.get("uploaded_at", 0)))
+
+    def list(self, workspace: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            return [dict(r) for r in self._documents.values()
+                    if workspace is None or r.get("workspace") == workspace]
+
+    def remove(self, workspace: str, key: str) -> List[Dict]:
+        """按document_id或原始文件名移除文档，返回被移除的记录"""
+        with self._lock:
+            removed = [r for r in self._documents.values()
+                       if r.get("workspace") == workspace and key in (r["document_id"], r.get("filename"))]
+            for record in removed:
+                del self._documents[record["document_id"]]
+            if removed:
+                self._save_locked()
+            return removed
@@ -0,0 +1,210 @@
+import os
+import time
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+from config import (EMBEDDING_MODEL, ENCODE_POOL_WORKERS, ENCODE_THREADS_PER_WORKER, ENCODE_BATCH_SIZE,
+                    ENCODE_POOL_MIN_TEXTS, ENCODE_WINDOW_BATCHES)
+
+# 工作进程内加载的嵌入模型
+_worker_model = None
+
+
+def _init_worker(model_name: str, threads: int):
+    """工作进程初始化：固定计算线程数后加载模型"""
+    for name in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+        os.environ[name] = str(threads)
+    os.environ["TOKENIZERS_PARALLELISM"] = "false"
+    import torch
+    torch.set_num_threads(threads)
+    from sentence_transformers import SentenceTransformer
+    global _worker_model
+    _worker_model = SentenceTransformer(model_name, device="cpu")
+
+
+def _encode_batch(texts: List[str], batch_size: int) -> List[List[float]]:
+    return _worker_model.encode(texts, batch_size=batch_size).tolist()
+
+
+def resolve_workers(workers: Optional[int] = ENCODE_POOL_WORKERS,
+                    threads: int = ENCODE_THREADS_PER_WORKER) -> int:
+    """工作进程数：None时按CPU核数/每进程线程数自动计算"""
+    if workers is None:
+        workers = (os.cpu_count() or 1) // max(threads, 1)
+    return max(workers, 0)
+
+
+class EncodePool:
+    """多进程嵌入编码池（面向只有CPU的机器的大批量入库）
+
+    输入按原顺序切成窗口，窗口内按文本长度排序后分批分发给各工作进程以减少padding浪费，
+    结果还原为原顺序后逐窗口返回，下一个窗口在当前窗口返回前已提交，写入和编码可以并行。
+    """
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL, workers: Optional[int] = ENCODE_POOL_WORKERS,
+                 threads_per_worker: int = ENCODE_THREADS_PER_WORKER, batch_size: int = ENCODE_BATCH_SIZE,
+                 window_batches: int = ENCODE_WINDOW_BATCHES):
+        self.model_name = model_name
+        self.threads_per_worker = max(threads_per_worker, 1)
+        self.workers = max(resolve_workers(workers, self.threads_per_worker), 1)
+        self.batch_size = batch_size
+        # 每个窗口包含的文本数
+        self.window_size = batch_size * self.workers * max(window_batches, 1)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+        self.last_report: Optional[Dict] = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                print(f"启动编码进程池: {self.workers} 进程 x {self.threads_per_worker} 线程, 模型 {self.model_name}")
+                # spawn避免在已初始化torch线程池的进程中fork
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.model_name, self.threads_per_worker)
+                )
+            return self._executor
+
+    def _submit_window(self, texts: List[str]):
+        """窗口内按长度排序分批提交，返回(原位置列表, future)"""
+        executor = self._get_executor()
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]), reverse=True)
+        jobs = []
+        for start in range(0, len(order), self.batch_size):
+            positions = order[start:start + self.batch_size]
+            future = executor.submit(_encode_batch, [texts[i] for i in positions], self.batch_size)
+            jobs.append((positions, future))
+        return jobs
+
+    def encode_stream(self, texts: List[str]) -> Iterator[Tuple[int, List[List[float]]]]:
+        """按原顺序逐窗口产出(窗口起始位置, 该窗口的嵌入向量)"""
+        started = time.perf_counter()
+        windows = range(0, len(texts), self.window_size)
+        pending = None
+        for window_start in list(windows) + [None]:
+            submitted = None
+            if window_start is not None:
+                submitted = (window_start, self._submit_window(texts[window_start:window_start + self.window_size]))
+            if pending is not None:
+                start, jobs = pending
+                embeddings = [None] * sum(len(positions) for positions, _ in jobs)
+                for positions, future in jobs:
+                    for position, embedding in zip(positions, future.result()):
+                        embeddings[position] = embedding
+                yield start, embeddings
+            pending = submitted
+        self._record(texts, time.perf_counter() - started)
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        """编码全部文本，结果顺序与输入一致"""
+        embeddings = []
+        for _, window in self.encode_stream(texts):
+            embeddings.extend(window)
+        return embeddings
+
+    def _record(self, texts: List[str], elapsed: float):
+        elapsed = max(elapsed, 1e-9)
+        chars = sum(len(text) for text in texts)
+        self.last_report = {
+            "texts": len(texts),
+            "chars": chars,
+            "elapsed_seconds": round(elapsed, 3),
+            "texts_per_second": round(len(texts) / elapsed, 1),
+            "chars_per_second": round(chars / elapsed),
+            "workers": self.workers,
+            "threads_per_worker": self.threads_per_worker,
+            "batch_size": self.batch_size
+        }
+        print(f"编码完成: {len(texts)} 个文本块, 用时 {elapsed:.2f}s, "
+              f"{self.last_report['texts_per_second']} 块/秒 "
+              f"({self.workers} 进程 x {self.threads_per_worker} 线程, batch {self.batch_size})")
+
+    def close(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True, cancel_futures=True)
+                self._executor = None
+
+
+_pools: Dict[str, EncodePool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_encode_pool(model_name: str) -> Optional[EncodePool]:
+    """获取模型对应的编码进程池，ENCODE_POOL_WORKERS为0时返回None"""
+    if resolve_workers() == 0:
+        return None
+    with _pools_lock:
+        pool = _pools.get(model_name)
+        if pool is None:
+            pool = EncodePool(model_name)
+            _pools[model_name] = pool
+        return pool
+
+
+def close_encode_pool(model_name: str):
+    """关闭模型对应的编码进程池（模型不再使用时释放工作进程）"""
+    with _pools_lock:
+        pool = _pools.pop(model_name, None)
+    if pool is not None:
+        print(f"关闭编码进程池: {model_name}")
+        pool.close()
+
+
+def close_encode_pools():
+    """关闭全部编码进程池（服务停止时调用）"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def encode_pool_reports() -> Dict[str, Optional[Dict]]:
+    """各编码进程池最近一次的吞吐统计"""
+    with _pools_lock:
+        return {name: pool.last_report for name, pool in _pools.items()}
+
+
+def encode_texts_stream(texts: List[str], model_name: str, model,
+                        min_texts: int = ENCODE_POOL_MIN_TEXTS) -> Iterator[Tuple[int, List[List[float]]]]:
+    """按原顺序逐窗口产出(窗口起始位置, 嵌入向量)：文本不少于min_texts时使用编码进程池，
+    否则在当前进程中用model一次编码全部文本"""
+    pool = get_encode_pool(model_name) if len(texts) >= min_texts else None
+    if pool is None:
+        yield 0, model.encode(texts, batch_size=ENCODE_BATCH_SIZE).tolist()
+        return
+    yield from pool.encode_stream(texts)
+
+
+# 吞吐对比：当前进程编码 vs 编码进程池
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="嵌入编码吞吐测试")
+    parser.add_argument("--texts", type=int, default=5000, help="测试文本块数")
+    parser.add_argument("--workers", type=int, default=None, help="工作进程数，默认按CPU核数计算")
+    parser.add_argument("--threads", type=int, default=ENCODE_THREADS_PER_WORKER, help="每个进程的线程数")
+    parser.add_argument("--batch-size", type=int, default=ENCODE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    from sentence_transformers import SentenceTransformer
+
+    sample = "文档处理包括读取、清理和分割文本，分割后的文本块应该保持语义完整性。"
+    texts = [sample * (1 + i % 12) for i in range(args.texts)]
+
+    model = SentenceTransformer(EMBEDDING_MODEL, device="cpu")
+    start = time.perf_counter()
+    model.encode(texts, batch_size=args.batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"当前进程: {len(texts) / elapsed:.1f} 块/秒 (用时 {elapsed:.2f}s)")
+
+    pool = EncodePool(EMBEDDING_MODEL, workers=args.workers, threads_per_worker=args.threads,
+                      batch_size=args.batch_size)
+    # 先编码少量文本完成进程启动和模型加载，不计入吞吐
+    pool.encode(texts[:pool.workers * args.batch_size])
+    pool.encode(texts)
+    print(f"编码进程池: {pool.last_report}")
+    pool.close()
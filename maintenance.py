@@ -0,0 +1,238 @@
+import os
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+from config import (UPLOAD_FOLDER, DEFAULT_WORKSPACE, WORKSPACE_DB_ROOT, MAINTENANCE_GRACE_SECONDS,
+                    MAINTENANCE_BATCH_SIZE, MAINTENANCE_PAUSE_SECONDS, MAINTENANCE_NICE,
+                    COMPACTION_TOMBSTONE_RATIO, COMPACTION_MIN_TOMBSTONES, MAINTENANCE_VACUUM_MIN_FREE_BYTES)
+from vector_db import WorkspaceManager, WORKSPACE_NAME_PATTERN
+from document_registry import DocumentRegistry
+from text_cache import TextCache
+
+
+def list_workspaces() -> List[str]:
+    """列出磁盘上存在的所有工作区"""
+    workspaces = [DEFAULT_WORKSPACE]
+    if os.path.isdir(WORKSPACE_DB_ROOT):
+        for name in sorted(os.listdir(WORKSPACE_DB_ROOT)):
+            if (name != DEFAULT_WORKSPACE and WORKSPACE_NAME_PATTERN.match(name)
+                    and os.path.isdir(os.path.join(WORKSPACE_DB_ROOT, name))):
+                workspaces.append(name)
+    return workspaces
+
+
+def directory_size(path: str) -> int:
+    """目录占用的字节数"""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def lower_priority():
+    """降低当前线程的调度优先级（Linux下nice值作用于线程）"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), MAINTENANCE_NICE)
+    except (AttributeError, OSError):
+        pass
+
+
+class MaintenanceTask:
+    """清理孤立的上传文件和文档块，并在删除较多时压缩向量索引"""
+
+    def __init__(self, workspaces: WorkspaceManager, registry: DocumentRegistry,
+                 upload_folder: str = UPLOAD_FOLDER, text_cache: Optional[TextCache] = None):
+        self.workspaces = workspaces
+        self.registry = registry
+        self.upload_folder = upload_folder
+        self.text_cache = text_cache
+        # 同一时间只允许一个维护任务运行
+        self._running = threading.Lock()
+        # 维护在专用的低优先级线程中执行（降低的nice值无法恢复，不能作用于处理请求的共享线程）
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="maintenance",
+                                            initializer=lower_priority)
+
+    def run(self, dry_run: bool = False, compact: bool = True, include_legacy: bool = False) -> Dict:
+        """执行一次维护，返回清理报告
+
+        dry_run为True时只统计不删除；上传文件只在确认没有任何文档块引用时才删除，
+        若存在缺少document_id的旧文档块（无法判断引用关系），默认跳过文件清理，
+        除非include_legacy为True。
+        """
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError("维护任务正在运行")
+        try:
+            return self._executor.submit(self._run, dry_run, compact, include_legacy).result()
+        finally:
+            self._running.release()
+
+    def _pause(self):
+        if MAINTENANCE_PAUSE_SECONDS:
+            time.sleep(MAINTENANCE_PAUSE_SECONDS)
+
+    def _recently_uploaded(self, document_id: str, metadata: Dict, now: float) -> bool:
+        """文档块在宽限期内上传，或其上传文件在扫描开始后才出现"""
+        uploaded_at = metadata.get("uploaded_at")
+        if uploaded_at is not None and now - uploaded_at < MAINTENANCE_GRACE_SECONDS:
+            return True
+        path = os.path.join(self.upload_folder, f"{document_id}{metadata.get('file_type', '')}")
+        return os.path.exists(path)
+
+    def _run(self, dry_run: bool, compact: bool, include_legacy: bool) -> Dict:
+        started = time.time()
+        report = {
+            "dry_run": dry_run,
+            "orphan_chunks": 0,
+            "orphan_files": 0,
+            "orphan_records": 0,
+            "orphan_text_cache": 0,
+            "legacy_chunks": 0,
+            "compacted_shards": [],
+            "vacuumed": [],
+            "bytes_reclaimed": 0
+        }
+        # 上传目录中的文件：document_id -> 路径
+        files = {}
+        if os.path.isdir(self.upload_folder):
+            for name in os.listdir(self.upload_folder):
+                path = os.path.join(self.upload_folder, name)
+                if os.path.isfile(path):
+                    files[os.path.splitext(name)[0]] = path
+
+        # 扫描所有工作区的文档块，找出被引用的文件和缺少文件的文档块
+        referenced = set()
+        for workspace in list_workspaces():
+            # 维护扫描不计入工作区的最近使用，避免把活跃工作区挤出缓存
+            with self.workspaces.use(workspace, touch=False) as db:
+                for index, shard in enumerate(db.shards()):
+                    orphan_ids = []
+                    offset = 0
+                    while True:
+                        batch = shard.get(limit=MAINTENANCE_BATCH_SIZE, offset=offset, include=["metadatas"])
+                        if not batch['ids']:
+                            break
+                        now = time.time()
+                        for chunk_id, metadata in zip(batch['ids'], batch['metadatas']):
+                            document_id = metadata.get("document_id")
+                            if not document_id:
+                                report["legacy_chunks"] += 1
+                            elif document_id in files:
+                                referenced.add(document_id)
+                            elif self._recently_uploaded(document_id, metadata, now):
+                                # 文件列表之后才上传的文档，不能当作孤立块
+                                referenced.add(document_id)
+                            else:
+                                orphan_ids.append(chunk_id)
+                        offset += len(batch['ids'])
+                        self._pause()
+                    report["orphan_chunks"] += len(orphan_ids)
+                    if orphan_ids and not dry_run:
+                        for i in range(0, len(orphan_ids), MAINTENANCE_BATCH_SIZE):
+                            db.delete_chunks(index, orphan_ids[i:i + MAINTENANCE_BATCH_SIZE])
+                            self._pause()
+                        print(f"工作区 '{workspace}' 分片 {index} 清理孤立文档块 {len(orphan_ids)} 个")
+
+        # 清理没有文档块引用的上传文件（跳过刚上传、可能仍在处理中的文件）
+        if report["legacy_chunks"] and not include_legacy:
+            print(f"存在 {report['legacy_chunks']} 个缺少document_id的旧文档块，跳过上传文件清理")
+        else:
+            now = time.time()
+            for document_id, path in files.items():
+                if document_id in referenced:
+                    continue
+                try:
+                    if now - os.path.getmtime(path) < MAINTENANCE_GRACE_SECONDS:
+                        continue
+                    size = os.path.getsize(path)
+                    if not dry_run:
+                        os.remove(path)
+                        print(f"删除孤立上传文件: {path}")
+                except OSError as e:
+                    print(f"清理文件 {path} 时出错: {e}")
+                    continue
+                report["orphan_files"] += 1
+                report["bytes_reclaimed"] += size
+
+        # 移除文件和文档块都已不存在的登记记录
+        for record in self.registry.list():
+            document_id = record["document_id"]
+            if document_id not in referenced and not os.path.exists(record.get("file_path", "")):
+                report["orphan_records"] += 1
+                if not dry_run:
+                    self.registry.remove(record.get("workspace", DEFAULT_WORKSPACE), document_id)
+
+        # 清理原始文件已不存在的文本缓存
+        if self.text_cache:
+            for document_id in self.text_cache.document_ids():
+                if document_id in referenced or os.path.exists(files.get(document_id, "")):
+                    continue
+                report["orphan_text_cache"] += 1
+                if not dry_run:
+                    report["bytes_reclaimed"] += self.text_cache.delete(document_id)
+
+        # 删除较多的分片重建索引，然后回收SQLite中已释放的页
+        if compact:
+            for workspace in list_workspaces():
+                with self.workspaces.use(workspace, touch=False) as db:
+                    for index in range(db.num_shards):
+                        live, tombstones = db.tombstone_stats(index)
+                        if tombstones < COMPACTION_MIN_TOMBSTONES:
+                            continue
+                        if tombstones / max(live + tombstones, 1) < COMPACTION_TOMBSTONE_RATIO:
+                            continue
+                        report["compacted_shards"].append(f"{workspace}/{index}")
+                        if dry_run:
+                            continue
+                        size_before = directory_size(db.db_path)
+                        db.compact_shard(index, MAINTENANCE_BATCH_SIZE, MAINTENANCE_PAUSE_SECONDS)
+                        # 记录带符号的变化量（磁盘占用增加时为负数）
+                        report["bytes_reclaimed"] += size_before - directory_size(db.db_path)
+                    if dry_run:
+                        continue
+                    reclaimed = db.vacuum(MAINTENANCE_VACUUM_MIN_FREE_BYTES)
+                    if reclaimed is not None:
+                        report["vacuumed"].append(workspace)
+                        report["bytes_reclaimed"] += reclaimed
+
+        # 释放空闲超时的工作区
+        self.workspaces.evict_idle()
+        report["elapsed_seconds"] = round(time.time() - started, 2)
+        print(f"维护完成: {report}")
+        return report
+
+
+def start_background_maintenance(task: MaintenanceTask, interval: float) -> Optional[threading.Thread]:
+    """启动定期执行维护的后台线程，interval不大于0时不启动"""
+    if interval <= 0:
+        return None
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            try:
+                task.run()
+            except Exception as e:
+                print(f"后台维护出错: {e}")
+
+    thread = threading.Thread(target=loop, name="maintenance", daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="清理孤立文件和文档块，压缩向量索引")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不删除")
+    parser.add_argument("--no-compact", action="store_true", help="不压缩向量索引")
+    parser.add_argument("--include-legacy", action="store_true",
+                        help="存在缺少document_id的旧文档块时仍清理上传文件")
+    args = parser.parse_args()
+    # 压缩会重建集合，运行中的后端进程持有的集合引用会失效，请在后端停止时执行
+    task = MaintenanceTask(WorkspaceManager(), DocumentRegistry(), text_cache=TextCache())
+    result = task.run(dry_run=args.dry_run, compact=not args.no_compact, include_legacy=args.include_legacy)
+    print(f"共回收空间: {result['bytes_reclaimed'] / 1024 / 1024:.2f}MB")
@@ -0,0 +1,215 @@
+import os
+import time
+import argparse
+import threading
+from contextlib import nullcontext
+from typing import Dict, List, Optional
+from config import UPLOAD_FOLDER, REINDEX_BATCH_SIZE, MAINTENANCE_BATCH_SIZE, ENCODE_BATCH_SIZE
+from document_processor import DocumentProcessor
+from admission import BULK
+from text_cache import TextCache
+from encode_pool import encode_texts_stream
+from vector_db import (VectorDatabase, WorkspaceManager, current_index_spec, index_prefix,
+                       workspace_needs_reindex)
+
+# 追赶重建期间新上传文档的最大轮数，之后在写锁内完成最后同步
+CATCH_UP_ROUNDS = 3
+
+
+def find_upload_file(document_id: str, upload_folder: str = UPLOAD_FOLDER) -> Optional[str]:
+    """根据document_id查找上传目录中的原始文件"""
+    if not os.path.isdir(upload_folder):
+        return None
+    for name in os.listdir(upload_folder):
+        if os.path.splitext(name)[0] == document_id:
+            return os.path.join(upload_folder, name)
+    return None
+
+
+class Reindexer:
+    """按当前配置在后台重建工作区索引
+
+    新索引建立在与线上索引并存的新集合中（集合名包含嵌入模型和分块参数的哈希），
+    重建期间查询和上传继续使用旧索引；建好后在写锁内同步期间的增删，再原子切换。
+    文档文本优先从已提取文本缓存读取，缓存缺失时才重新解析原文件并写入缓存；
+    没有document_id的旧文档块无法对应原文件，保持原有分块只重新生成嵌入向量。
+    """
+
+    def __init__(self, workspaces: WorkspaceManager, text_cache: TextCache, limiter=None,
+                 upload_folder: str = UPLOAD_FOLDER):
+        self.workspaces = workspaces
+        self.text_cache = text_cache
+        # 嵌入计算的并发限制（与上传入库共享），为None时不限制
+        self.limiter = limiter
+        self.upload_folder = upload_folder
+        self._status: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def status(self) -> Dict:
+        with self._lock:
+            return {workspace: dict(status) for workspace, status in self._status.items()}
+
+    def _update_status(self, workspace: str, **fields):
+        with self._lock:
+            self._status.setdefault(workspace, {}).update(fields)
+
+    def is_running(self, workspace: str) -> bool:
+        with self._lock:
+            return self._status.get(workspace, {}).get("state") == "running"
+
+    def start(self, workspaces: List[str]) -> List[str]:
+        """为需要重建的工作区启动后台线程，返回已启动的工作区"""
+        started = []
+        for workspace in workspaces:
+            if self.is_running(workspace) or not workspace_needs_reindex(workspace):
+                continue
+            self._update_status(workspace, state="running")
+            thread = threading.Thread(target=self.reindex_workspace, args=(workspace,),
+                                      name=f"reindex-{workspace}", daemon=True)
+            thread.start()
+            started.append(workspace)
+        return started
+
+    def _scan(self, db: VectorDatabase) -> Dict[str, Dict]:
+        """扫描线上索引中的文档：有document_id的按id归并，旧文档块按文档名归并并记录块id"""
+        documents = {}
+        for shard_index, shard in enumerate(db.shards()):
+            offset = 0
+            while True:
+                batch = shard.get(limit=MAINTENANCE_BATCH_SIZE, offset=offset, include=["metadatas"])
+                if not batch['ids']:
+                    break
+                for chunk_id, metadata in zip(batch['ids'], batch['metadatas']):
+                    document_id = metadata.get("document_id")
+                    if document_id:
+                        documents.setdefault(document_id, metadata)
+                    else:
+                        legacy = documents.setdefault(f"legacy:{metadata['source']}",
+                                                      {"source": metadata['source'], "ids": []})
+                        legacy["ids"].append((shard_index, chunk_id))
+                offset += len(batch['ids'])
+        return documents
+
+    def _document_chunks(self, db: VectorDatabase, processor: DocumentProcessor, key: str, info: Dict):
+        """按新的分块参数生成文档块，无法获取文本时返回None"""
+        if key.startswith("legacy:"):
+            shards = db.shards()
+            ids_by_shard: Dict[int, List[str]] = {}
+            for shard_index, chunk_id in info["ids"]:
+                ids_by_shard.setdefault(shard_index, []).append(chunk_id)
+            chunks = []
+            for shard_index, ids in ids_by_shard.items():
+                result = shards[shard_index].get(ids=ids, include=["documents", "metadatas"])
+                chunks.extend(zip(result['documents'], result['metadatas']))
+            return sorted(chunks, key=lambda chunk: chunk[1].get("chunk_id", 0))
+
+        document_id = info["document_id"]
+        text = self.text_cache.get(document_id)
+        if text is None:
+            file_path = find_upload_file(document_id, self.upload_folder)
+            if not file_path:
+                print(f"文档 {document_id} 的原始文件不存在，跳过")
+                return None
+            text = processor.extract_text(file_path)
+            self.text_cache.put(document_id, text)
+        extra = {field: info[field] for field in ("document_id", "uploaded_at") if field in info}
+        return processor.chunk_text(text, info["source"], info.get("file_type", ""), extra)
+
+    def _build_document(self, db: VectorDatabase, targets: List, model_name: str, model,
+                        processor: DocumentProcessor, key: str, info: Dict, limited: bool = True) -> bool:
+        """为新索引生成文档块；limited为False时不经过嵌入并发限制（在写锁内调用时使用，避免与上传互相等待）"""
+        chunks = self._document_chunks(db, processor, key, info)
+        if not chunks:
+            return False
+        target = targets[db.shard_for(info["source"])]
+        texts = [chunk[0] for chunk in chunks]
+        metadatas = [chunk[1] for chunk in chunks]
+        # 整个文档一起编码：超过一批的文档交给编码进程池（重建是长任务，进程池启动开销可以忽略），
+        # 编码结果按窗口返回，边编码边分批写入新索引
+        with self.limiter.acquire(BULK, blocking=True) if self.limiter and limited else nullcontext():
+            for window_start, embeddings in encode_texts_stream(texts, model_name, model,
+                                                                min_texts=ENCODE_BATCH_SIZE + 1):
+                for start in range(0, len(embeddings), REINDEX_BATCH_SIZE):
+                    batch = slice(window_start + start, window_start + start + REINDEX_BATCH_SIZE)
+                    target.upsert(
+                        ids=[f"{metadata['source']}_{metadata['chunk_id']}" for metadata in metadatas[batch]],
+                        embeddings=embeddings[start:start + REINDEX_BATCH_SIZE],
+                        documents=texts[batch],
+                        metadatas=metadatas[batch]
+                    )
+        return True
+
+    def _remove_document(self, db: VectorDatabase, targets: List, key: str, info: Dict):
+        where = {"source": info["source"]} if key.startswith("legacy:") else {"document_id": key}
+        targets[db.shard_for(info["source"])].delete(where=where)
+
+    def reindex_workspace(self, workspace: str) -> Dict:
+        """重建工作区索引（同步执行），返回状态"""
+        started = time.time()
+        self._update_status(workspace, state="running", started_at=started, error=None,
+                            documents_done=0, documents_total=0)
+        try:
+            # 重建期间占用工作区，避免被空闲/LRU释放
+            with self.workspaces.use(workspace) as db:
+                if not db.needs_reindex:
+                    self._update_status(workspace, state="up_to_date", finished_at=time.time())
+                    return self.status()[workspace]
+                spec = current_index_spec()
+                prefix = index_prefix(spec)
+                print(f"开始重建工作区 '{workspace}' 的索引: {db.index['prefix']} -> {prefix} {spec}")
+                self._update_status(workspace, prefix=prefix, spec=spec)
+                model = self.workspaces.load_model(spec["embedding_model"])
+                processor = DocumentProcessor(spec["chunk_size"], spec["chunk_overlap"])
+                # 清理上次中断留下的半成品
+                db.drop_index(prefix)
+                targets = db.index_collections(prefix)
+
+                built: Dict[str, Dict] = {}
+                for _ in range(CATCH_UP_ROUNDS):
+                    documents = self._scan(db)
+                    pending = {key: info for key, info in documents.items() if key not in built}
+                    if not pending:
+                        break
+                    self._update_status(workspace, documents_total=len(documents))
+                    for key, info in pending.items():
+                        self._build_document(db, targets, spec["embedding_model"], model, processor, key, info)
+                        built[key] = info
+                        self._update_status(workspace, documents_done=len(built))
+
+                # 在写锁内同步重建期间的增删，然后切换索引（追赶轮次后剩余的文档通常很少，
+                # 上传可能持有嵌入并发名额等待写锁，因此这里不再经过并发限制）
+                def sync():
+                    documents.clear()
+                    documents.update(self._scan(db))
+                    for key in set(built) - set(documents):
+                        self._remove_document(db, targets, key, built[key])
+                    for key, info in documents.items():
+                        if key not in built:
+                            self._build_document(db, targets, spec["embedding_model"], model, processor, key, info,
+                                                 limited=False)
+
+                documents = {}
+                old_prefix = db.activate_index(prefix, spec, model, sync=sync)
+                db.drop_index(old_prefix)
+                self.workspaces.prune_models()
+
+                finished = time.time()
+                self._update_status(workspace, state="done", finished_at=finished,
+                                    documents_total=len(documents), documents_done=len(documents))
+                print(f"工作区 '{workspace}' 索引重建完成，用时 {finished - started:.1f} 秒")
+        except Exception as e:
+            print(f"重建工作区 '{workspace}' 索引时出错: {e}")
+            self._update_status(workspace, state="failed", error=str(e), finished_at=time.time())
+        return self.status()[workspace]
+
+
+if __name__ == "__main__":
+    from maintenance import list_workspaces
+
+    parser = argparse.ArgumentParser(description="按当前配置重建向量索引")
+    parser.add_argument("--workspace", action="append", help="只重建指定工作区（可多次指定），默认全部")
+    args = parser.parse_args()
+    # 切换索引后运行中的后端进程仍会使用旧索引，请在后端停止时执行，或调用后端的/reindex接口
+    reindexer = Reindexer(WorkspaceManager(), TextCache())
+    for name in args.workspace or list_workspaces():
+        print(f"{name}: {reindexer.reindex_workspace(name)}")
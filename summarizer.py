@@ -0,0 +1,87 @@
+import re
+from typing import List, Callable
+from config import SUMMARY_GROUP_CHARS
+
+# 概述类问题（总结、概括、关键点等），用于判断是否可直接使用预先生成的摘要
+SUMMARY_QUESTION_PATTERN = re.compile(
+    r"(总结|概括|概述|摘要|主要内容|大意|关键点|要点|核心内容|讲了什么|说了什么|summar\w*|overview|tl;?dr)",
+    re.IGNORECASE
+)
+# 概述类问题中不影响含义的客套、指代文档和疑问的词；去掉概述词和这些词后仍有剩余，
+# 说明问题针对具体内容（如“第三章的付款要点是什么”），不能用整篇摘要回答
+SUMMARY_FILLER_PATTERN = re.compile(
+    r"(请|帮我|帮忙|给我|能否|可以|你|一下|简单|简要|简述|大致|这篇|这份|这个|该|本|此|整篇|全文|文档|文件|文章|"
+    r"所有|全部|主要|重要|一份|一段|"
+    r"的|是|什么|有哪些|哪些|有|吗|呢|列出|列举|出来|给出|生成|写|说说|讲讲|"
+    r"\b(?:please|can|could|you|give|me|the|a|an|of|this|document|file|what|is|are|key|points?|main)\b|"
+    r"[\s,，、。.!！?？:：;；])",
+    re.IGNORECASE
+)
+
+MAP_INSTRUCTION = "请概括以上文档片段的主要内容，并以要点形式列出其中的关键信息，不要添加文档以外的内容。"
+REDUCE_INSTRUCTION = "以上是同一文档各部分的摘要，请将它们合并为一份完整的文档摘要：先用一段话总结主要内容，再以要点形式列出所有关键点。"
+
+
+def is_summary_question(question: str) -> bool:
+    """判断问题是否为只针对整篇文档的概述类问题（不含其他内容限定）"""
+    if not SUMMARY_QUESTION_PATTERN.search(question):
+        return False
+    rest = SUMMARY_FILLER_PATTERN.sub("", SUMMARY_QUESTION_PATTERN.sub("", question))
+    return not rest
+
+
+def group_texts(texts: List[str], max_chars: int = SUMMARY_GROUP_CHARS) -> List[str]:
+    """将文本块按顺序合并为不超过max_chars的分组"""
+    groups = []
+    current = ""
+    for text in texts:
+        if current and len(current) + len(text) + 2 > max_chars:
+            groups.append(current)
+            current = ""
+        current = f"{current}\n\n{text}" if current else text
+    if current:
+        groups.append(current)
+    return groups
+
+
+def summarize_chunks(summarize: Callable[[str, str], str], chunks: List[str],
+                     max_chars: int = SUMMARY_GROUP_CHARS) -> str:
+    """分层（map-reduce）生成文档摘要
+
+    先对每组文本块分别概括，再把各组摘要逐层合并，直到只剩一份摘要。
+    summarize(text, instruction)负责调用大模型，出错时抛出异常。
+    """
+    if not chunks:
+        raise ValueError("文档内容为空，无法生成摘要")
+    groups = group_texts(chunks, max_chars)
+    print(f"生成摘要: {len(chunks)} 个文本块分为 {len(groups)} 组")
+    summaries = [summarize(group, MAP_INSTRUCTION) for group in groups]
+    level = 1
+    while len(summaries) > 1:
+        groups = group_texts(summaries, max_chars)
+        # 单份摘要已接近长度上限时两两合并，保证每层都在收敛
+        if len(groups) == len(summaries):
+            groups = ["\n\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+        print(f"合并摘要（第 {level} 层）: {len(summaries)} 份 -> {len(groups)} 份")
+        summaries = [summarize(group, REDUCE_INSTRUCTION) for group in groups]
+        level += 1
+    return summaries[0]
+
+
+# 检查概述类问题的判断（含前端示例问题）
+if __name__ == "__main__":
+    examples = {
+        "总结文档的主要内容": True,
+        "列出所有关键点": True,
+        "给出文档摘要": True,
+        "这篇文章讲了什么？": True,
+        "summarize this document": True,
+        "文档中提到了哪些重要概念？": False,
+        "作者的主要观点是什么？": False,
+        "第三章的付款要点是什么": False,
+        "付款条款的摘要": False,
+    }
+    for question, expected in examples.items():
+        result = is_summary_question(question)
+        print(f"{'✓' if result == expected else '✗'} {question}: {result}")
+    assert all(is_summary_question(question) == expected for question, expected in examples.items())
@@ -0,0 +1,41 @@
+import os
+from typing import List, Optional
+from config import TEXT_CACHE_FOLDER
+
+
+class TextCache:
+    """已提取文本的缓存：按document_id保存清理后的文档文本，重建索引时无需重新解析原文件"""
+
+    def __init__(self, folder: str = TEXT_CACHE_FOLDER):
+        self.folder = folder
+        os.makedirs(folder, exist_ok=True)
+
+    def _path(self, document_id: str) -> str:
+        return os.path.join(self.folder, f"{os.path.basename(document_id)}.txt")
+
+    def put(self, document_id: str, text: str):
+        # 先写临时文件再替换，避免读到写了一半的缓存
+        path = self._path(document_id)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def get(self, document_id: str) -> Optional[str]:
+        path = self._path(document_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def delete(self, document_id: str) -> int:
+        """删除缓存，返回释放的字节数"""
+        path = self._path(document_id)
+        if not os.path.exists(path):
+            return 0
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+
+    def document_ids(self) -> List[str]:
+        return [name[:-len(".txt")] for name in os.listdir(self.folder) if name.endswith(".txt")]
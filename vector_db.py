@@ -1,21 +1,283 @@
 import chromadb
 from sentence_transformers import SentenceTransformer
 import os
+import re
+import time
+import heapq
+import json
+import sqlite3
+import zlib
+import hashlib
+import threading
 import urllib.parse
-from typing import List, Tuple, Dict
-from config import VECTOR_DB_PATH, EMBEDDING_MODEL
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple, Dict, Optional, Callable
+from config import (VECTOR_DB_PATH, EMBEDDING_MODEL, CHUNK_SIZE, CHUNK_OVERLAP, DEFAULT_WORKSPACE, WORKSPACE_DB_ROOT,
+                    SHARDS_PER_WORKSPACE, SHARD_QUERY_CONCURRENCY, MAX_LOADED_WORKSPACES,
+                    WORKSPACE_IDLE_SECONDS, RELEVANCE_MAX_DISTANCE, RELEVANCE_SCORE_GAP,
+                    RELEVANCE_PROBE_PERCENTILE, RELEVANCE_PROBE_QUESTIONS)
+from encode_pool import encode_texts_stream, close_encode_pool
+
+# 工作区名称只允许字母、数字、下划线和短横线
+WORKSPACE_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# 未记录索引参数的旧数据使用的集合名前缀
+LEGACY_INDEX_PREFIX = "documents"
+
+
+def current_index_spec() -> Dict:
+    """当前配置对应的索引参数，参数不同的向量不能放在同一集合中"""
+    return {"embedding_model": EMBEDDING_MODEL, "chunk_size": CHUNK_SIZE, "chunk_overlap": CHUNK_OVERLAP}
+
+
+def index_prefix(spec: Dict) -> str:
+    """索引参数对应的集合名前缀"""
+    key = json.dumps(spec, sort_keys=True)
+    return f"documents-{hashlib.md5(key.encode('utf-8')).hexdigest()[:8]}"
+
+
+def workspace_db_path(workspace: str) -> str:
+    """工作区的向量库目录，默认工作区沿用原路径"""
+    return VECTOR_DB_PATH if workspace == DEFAULT_WORKSPACE else os.path.join(WORKSPACE_DB_ROOT, workspace)
+
+
+def workspace_needs_reindex(workspace: str) -> bool:
+    """不加载工作区，直接根据索引记录判断是否需要重建（没有记录的旧数据视为与当前配置一致）"""
+    index_path = os.path.join(workspace_db_path(workspace), "index.json")
+    if not os.path.exists(index_path):
+        return False
+    with open(index_path, 'r', encoding='utf-8') as f:
+        index = json.load(f)
+    spec = current_index_spec()
+    return {key: index.get(key) for key in spec} != spec
+
+
+def load_embedding_model(name: str) -> SentenceTransformer:
+    print(f"正在加载嵌入模型 {name}...")
+    model = SentenceTransformer(name)
+    print("嵌入模型加载完成！")
+    return model
+
+
+def build_where_filter(sources: Optional[List[str]] = None,
+                       document_ids: Optional[List[str]] = None,
+                       file_types: Optional[List[str]] = None,
+                       uploaded_after: Optional[float] = None,
+                       uploaded_before: Optional[float] = None) -> Optional[Dict]:
+    """根据文档范围和元数据条件构建Chroma的where过滤条件，无条件时返回None"""
+    conditions = []
+    if sources:
+        conditions.append({"source": {"$in": [urllib.parse.unquote(s) for s in sources]}})
+    if document_ids:
+        conditions.append({"document_id": {"$in": list(document_ids)}})
+    if file_types:
+        conditions.append({"file_type": {"$in": [t.lower() if t.startswith('.') else f".{t.lower()}"
+                                                  for t in file_types]}})
+    if uploaded_after is not None:
+        conditions.append({"uploaded_at": {"$gte": uploaded_after}})
+    if uploaded_before is not None:
+        conditions.append({"uploaded_at": {"$lte": uploaded_before}})
+    if not conditions:
+        return None
+    if len(conditions) == 1:
+        return conditions[0]
+    return {"$and": conditions}
+
+
+def filter_by_relevance(results: List[Tuple[str, Dict, float]],
+                        max_distance: Optional[float] = RELEVANCE_MAX_DISTANCE,
+                        max_gap: Optional[float] = RELEVANCE_SCORE_GAP) -> List[Tuple[str, Dict, float]]:
+    """按相关性筛选检索结果（结果需按距离升序）
+
+    超过max_distance的块直接丢弃；其余块只在与最相关块的距离差不超过max_gap时保留，
+    因此最终返回的块数会随分数分布自适应。全部不达标时返回空列表。
+    """
+    selected = []
+    for doc, metadata, distance in results:
+        if max_distance is not None and distance > max_distance:
+            break
+        if selected and max_gap is not None and distance - selected[0][2] > max_gap:
+            break
+        selected.append((doc, metadata, distance))
+    return selected
+
+
+def embedding_distance(a: List[float], b: List[float]) -> float:
+    """两个向量的平方L2距离（与Chroma集合默认的l2距离一致，可与检索返回的距离直接比较）"""
+    return sum((x - y) * (x - y) for x, y in zip(a, b))
 
 
 class VectorDatabase:
-    def __init__(self):
-        # 创建持久化向量数据库客户端
-        self.client = chromadb.PersistentClient(path=VECTOR_DB_PATH)
-        # 获取或创建集合
-        self.collection = self.client.get_or_create_collection(name="documents")
-        # 加载嵌入模型
-        print("正在加载嵌入模型...")
-        self.embedding_model = SentenceTransformer(EMBEDDING_MODEL)
-        print("嵌入模型加载完成！")
+    def __init__(self, workspace: str = DEFAULT_WORKSPACE, num_shards: int = SHARDS_PER_WORKSPACE,
+                 model_loader: Callable[[str], SentenceTransformer] = load_embedding_model):
+        if not WORKSPACE_NAME_PATTERN.match(workspace):
+            raise ValueError(f"无效的工作区名称: {workspace}")
+        self.workspace = workspace
+        self.num_shards = max(1, num_shards)
+        # 创建持久化向量数据库客户端（每个工作区独立目录，默认工作区沿用原路径）
+        self.db_path = workspace_db_path(workspace)
+        self.client = chromadb.PersistentClient(path=self.db_path)
+        # 当前生效的索引（集合名前缀及其嵌入模型、分块参数），重建索引完成后切换
+        self._index_path = os.path.join(self.db_path, "index.json")
+        self.index = self._load_index(model_loader)
+        # 分片集合在首次使用时才获取或创建
+        self._shards: Dict[int, object] = {}
+        self._shards_lock = threading.RLock()
+        # 写操作锁：压缩切换分片集合、重建索引切换期间暂停写入，查询不受影响
+        self._write_lock = threading.RLock()
+        # 各分片自上次压缩以来删除的块数（Chroma的HNSW索引删除后不会缩小）
+        self._tombstones_path = os.path.join(self.db_path, "tombstones.json")
+        self._tombstones: Dict[str, int] = self._load_tombstones()
+        # 恢复上次中断的分片压缩（须在首次获取分片前完成，否则会新建空集合）
+        self._recover_compaction()
+        # 语料版本：每次增删文档后递增，用于接口缓存校验
+        self.loaded_at = time.time()
+        self.version = 0
+        self.last_modified = self.loaded_at
+        self._documents_cache: Optional[List[str]] = None
+        # 按语料校准的相关性阈值：(ETag, 阈值)
+        self._relevance_threshold: Optional[Tuple[str, Optional[float]]] = None
+        # 加载当前索引使用的嵌入模型（可由外部提供共享的加载函数）
+        self.embedding_model = model_loader(self.index["embedding_model"])
+
+    def _load_index(self, model_loader: Callable[[str], SentenceTransformer]) -> Dict:
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        # 没有记录时视为按当前配置建立的旧数据，沿用原集合名；
+        # 登记前核对已有向量的维度，维度不同说明旧数据由其他模型生成，不能按当前配置登记
+        index = {"prefix": LEGACY_INDEX_PREFIX, **current_index_spec()}
+        self._recover_compaction(LEGACY_INDEX_PREFIX)
+        dimension = self._stored_dimension(LEGACY_INDEX_PREFIX)
+        if dimension is not None:
+            expected = model_loader(EMBEDDING_MODEL).get_sentence_embedding_dimension()
+            if dimension != expected:
+                raise RuntimeError(
+                    f"工作区 '{self.workspace}' 的已有向量为 {dimension} 维，与当前嵌入模型 {EMBEDDING_MODEL} "
+                    f"的 {expected} 维不一致：请先用生成旧数据的模型启动一次以登记索引，再修改配置触发重建")
+        self._save_index(index)
+        return index
+
+    def _stored_dimension(self, prefix: str) -> Optional[int]:
+        """指定前缀的集合中已有向量的维度，没有数据时返回None"""
+        for i in range(self.num_shards):
+            try:
+                shard = self.client.get_collection(self._shard_name(i, prefix))
+            except ValueError:
+                continue
+            result = shard.get(limit=1, include=["embeddings"])
+            if result['ids']:
+                return len(result['embeddings'][0])
+        return None
+
+    def _save_index(self, index: Dict):
+        tmp_path = f"{self._index_path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(tmp_path, self._index_path)
+
+    @property
+    def needs_reindex(self) -> bool:
+        """当前索引参数与配置不一致，需要重建"""
+        spec = current_index_spec()
+        return {key: self.index.get(key) for key in spec} != spec
+
+    def _shard_name(self, index: int, prefix: Optional[str] = None) -> str:
+        prefix = prefix or self.index["prefix"]
+        return prefix if index == 0 else f"{prefix}_{index}"
+
+    def index_collections(self, prefix: str) -> List:
+        """获取或创建指定前缀的全部分片集合（用于在后台建立新索引）"""
+        return [self.client.get_or_create_collection(name=self._shard_name(i, prefix))
+                for i in range(self.num_shards)]
+
+    def drop_index(self, prefix: str):
+        """删除指定前缀的全部分片集合"""
+        for i in range(self.num_shards):
+            try:
+                self.client.delete_collection(self._shard_name(i, prefix))
+            except ValueError:
+                pass
+
+    def activate_index(self, prefix: str, spec: Dict, embedding_model: SentenceTransformer,
+                       sync: Optional[Callable[[], None]] = None) -> str:
+        """切换到新建好的索引，返回旧索引前缀
+
+        sync在写锁内、切换前调用，用于同步重建期间的增删（此时写入暂停，sync内不应等待其他资源）。
+        """
+        with self._write_lock:
+            if sync:
+                sync()
+            with self._shards_lock:
+                old_prefix = self.index["prefix"]
+                self.index = {"prefix": prefix, **spec}
+                self._save_index(self.index)
+                self._shards = {}
+                self.embedding_model = embedding_model
+                self._bump_version()
+        print(f"工作区 '{self.workspace}' 已切换到索引 {prefix}")
+        return old_prefix
+
+    def _snapshot(self) -> Tuple[SentenceTransformer, List]:
+        """同时取得当前嵌入模型和分片集合，避免在切换索引时混用"""
+        with self._shards_lock:
+            return self.embedding_model, self.shards()
+
+    def _get_shard(self, index: int):
+        """获取分片集合（懒加载）"""
+        shard = self._shards.get(index)
+        if shard is None:
+            with self._shards_lock:
+                shard = self._shards.get(index)
+                if shard is None:
+                    shard = self.client.get_or_create_collection(name=self._shard_name(index))
+                    self._shards[index] = shard
+        return shard
+
+    @property
+    def collection(self):
+        """第0个分片（单分片时即为整个集合）"""
+        return self._get_shard(0)
+
+    def shards(self) -> List:
+        """所有分片集合"""
+        return [self._get_shard(i) for i in range(self.num_shards)]
+
+    def shard_for(self, source: str) -> int:
+        """按文档名哈希确定分片，同一文档的所有块落在同一分片"""
+        return zlib.crc32(source.encode("utf-8")) % self.num_shards
+
+    def _load_tombstones(self) -> Dict[str, int]:
+        if not os.path.exists(self._tombstones_path):
+            return {}
+        try:
+            with open(self._tombstones_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"读取删除记录时出错: {e}")
+            return {}
+
+    def _add_tombstones(self, index: int, count: int):
+        name = self._shard_name(index)
+        self._tombstones[name] = self._tombstones.get(name, 0) + count
+        with open(self._tombstones_path, 'w', encoding='utf-8') as f:
+            json.dump(self._tombstones, f)
+
+    def tombstone_stats(self, index: int) -> Tuple[int, int]:
+        """返回分片的(有效块数, 自上次压缩以来已删除块数)"""
+        return self._get_shard(index).count(), self._tombstones.get(self._shard_name(index), 0)
+
+    def _bump_version(self):
+        self.version += 1
+        self.last_modified = time.time()
+        self._documents_cache = None
+
+    @property
+    def etag(self) -> str:
+        """当前语料版本对应的ETag（包含加载时间，工作区重新加载后不会与旧版本混淆）"""
+        return f'"{self.workspace}-{int(self.loaded_at * 1000)}-{self.version}"'
 
     def add_documents(self, documents: List[Tuple[str, Dict]]):
         """添加文档到向量数据库"""
@@ -26,72 +288,442 @@ class VectorDatabase:
         metadatas = [doc[1] for doc in documents]
         ids = [f"{metadata['source']}_{metadata['chunk_id']}" for metadata in metadatas]
         print(f"正在处理 {len(texts)} 个文档块...")
-        # 生成embedding
+        # 生成embedding（文本块较多时使用编码进程池，按窗口边编码边写入）
         print("正在生成嵌入向量...")
-        embeddings = self.embedding_model.encode(texts).tolist()
-        # 添加到集合
+        model = self.embedding_model
         print("正在添加到向量数据库...")
-        self.collection.add(
-            embeddings=embeddings,
-            documents=texts,
-            metadatas=metadatas,
-            ids=ids
-        )
+        for start, embeddings in encode_texts_stream(texts, self.index["embedding_model"], model):
+            end = start + len(embeddings)
+            with self._write_lock:
+                # 编码期间已切换到新索引时，用新模型重新编码
+                if model is not self.embedding_model:
+                    embeddings = self.embedding_model.encode(texts[start:end]).tolist()
+                # 按分片分组后添加到集合
+                groups: Dict[int, List[int]] = {}
+                for i in range(start, end):
+                    groups.setdefault(self.shard_for(metadatas[i]['source']), []).append(i)
+                for shard_index, positions in groups.items():
+                    self._get_shard(shard_index).add(
+                        embeddings=[embeddings[i - start] for i in positions],
+                        documents=[texts[i] for i in positions],
+                        metadatas=[metadatas[i] for i in positions],
+                        ids=[ids[i] for i in positions]
+                    )
+                self._bump_version()
         print(f"成功添加 {len(texts)} 个文档块到向量数据库")
 
-    def search(self, query: str, n_results: int = 5) -> List[Tuple[str, Dict]]:
-        """搜索相关文档"""
+    def _query_shards(self, shards: List, query_embeddings: List[List[float]], n_results: int,
+                      where: Optional[Dict] = None, with_embeddings: bool = False) -> List[List[Tuple]]:
+        """在所有分片上并行查询，并按距离合并每个查询的top-k结果
+
+        结果为(文档, 元数据, 距离)；with_embeddings为True时追加(块id, 块向量)。
+        """
+        include = ["documents", "metadatas", "distances"] + (["embeddings"] if with_embeddings else [])
+
+        def query_shard(shard):
+            return shard.query(
+                query_embeddings=query_embeddings,
+                n_results=n_results,
+                where=where,
+                include=include
+            )
+
+        if len(shards) == 1:
+            shard_results = [query_shard(shards[0])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(SHARD_QUERY_CONCURRENCY, len(shards))) as executor:
+                shard_results = list(executor.map(query_shard, shards))
+
+        merged = []
+        for row in range(len(query_embeddings)):
+            candidates = []
+            for results in shard_results:
+                if not results['documents']:
+                    continue
+                columns = [results['documents'][row], results['metadatas'][row], results['distances'][row]]
+                if with_embeddings:
+                    columns += [results['ids'][row], [list(embedding) for embedding in results['embeddings'][row]]]
+                candidates.extend(zip(*columns))
+            merged.append(heapq.nsmallest(n_results, candidates, key=lambda item: item[2]))
+        return merged
+
+    def encode_query(self, query: str) -> Tuple[List[float], List]:
+        """生成查询向量，同时返回与之对应的分片快照（配合search_by_embedding使用）"""
+        model, shards = self._snapshot()
+        return model.encode([query]).tolist()[0], shards
+
+    def search_by_embedding(self, query_embedding: List[float], shards: List, n_results: int = 5,
+                            where: Optional[Dict] = None) -> List[Tuple[str, Dict, float, str, List[float]]]:
+        """用已生成的查询向量检索，结果附带块id和块向量（用于对话会话内复用候选块）"""
+        search_results = self._query_shards(shards, [query_embedding], n_results, where, with_embeddings=True)[0]
+        print(f"找到 {len(search_results)} 个相关文档块")
+        return search_results
+
+    def search_with_scores(self, query: str, n_results: int = 5,
+                           where: Optional[Dict] = None) -> List[Tuple[str, Dict, float]]:
+        """搜索相关文档并返回距离（按距离升序，where为元数据过滤条件，由向量库在查询时过滤）"""
         if not query.strip():
             return []
-        print(f"搜索查询: '{query}'")
+        print(f"搜索查询: '{query}'" + (f", 过滤条件: {where}" if where else ""))
+        model, shards = self._snapshot()
         # 生成查询的embedding
-        query_embedding = self.embedding_model.encode([query]).tolist()
-        # 搜索
-        results = self.collection.query(
-            query_embeddings=query_embedding,
-            n_results=n_results
-        )
-        # 整理结果
-        search_results = []
-        if results['documents']:
-            for i in range(len(results['documents'][0])):
-                doc = results['documents'][0][i]
-                metadata = results['metadatas'][0][i]
-                search_results.append((doc, metadata))
+        query_embedding = model.encode([query]).tolist()
+        # 搜索并整理结果
+        search_results = self._query_shards(shards, query_embedding, n_results, where)[0]
         print(f"找到 {len(search_results)} 个相关文档块")
         return search_results
 
+    def search(self, query: str, n_results: int = 5, where: Optional[Dict] = None) -> List[Tuple[str, Dict]]:
+        """搜索相关文档"""
+        return [(doc, metadata) for doc, metadata, _ in self.search_with_scores(query, n_results, where)]
+
+    def search_batch_with_scores(self, queries: List[str], n_results: int = 5,
+                                 where: Optional[Dict] = None) -> List[List[Tuple[str, Dict, float]]]:
+        """批量搜索相关文档并返回距离（一次编码、一次查询），结果顺序与queries一致"""
+        batch_results = [[] for _ in queries]
+        valid_indexes = [i for i, query in enumerate(queries) if query.strip()]
+        if not valid_indexes:
+            return batch_results
+        print(f"批量搜索 {len(valid_indexes)} 个查询...")
+        model, shards = self._snapshot()
+        # 一次性生成所有查询的embedding
+        query_embeddings = model.encode([queries[i] for i in valid_indexes]).tolist()
+        # 一次多向量查询
+        merged = self._query_shards(shards, query_embeddings, n_results, where)
+        for row, query_index in enumerate(valid_indexes):
+            batch_results[query_index] = merged[row]
+        print(f"批量搜索完成，共 {sum(len(r) for r in batch_results)} 个相关文档块")
+        return batch_results
+
+    def search_batch(self, queries: List[str], n_results: int = 5,
+                     where: Optional[Dict] = None) -> List[List[Tuple[str, Dict]]]:
+        """批量搜索相关文档，结果顺序与queries一致"""
+        return [[(doc, metadata) for doc, metadata, _ in results]
+                for results in self.search_batch_with_scores(queries, n_results, where)]
+
+    def relevance_threshold(self) -> Optional[float]:
+        """按当前语料校准的相关性距离阈值（语料未变化时直接使用缓存）
+
+        用RELEVANCE_PROBE_QUESTIONS中与文档无关的问题检索语料，取其最相关块距离的
+        RELEVANCE_PROBE_PERCENTILE分位数，且不超过RELEVANCE_MAX_DISTANCE；语料为空时返回上限。
+        """
+        if RELEVANCE_MAX_DISTANCE is None or not RELEVANCE_PROBE_QUESTIONS:
+            return RELEVANCE_MAX_DISTANCE
+        etag = self.etag
+        cached = self._relevance_threshold
+        if cached is not None and cached[0] == etag:
+            return cached[1]
+        probes = self.search_batch_with_scores(RELEVANCE_PROBE_QUESTIONS, n_results=1)
+        distances = sorted(results[0][2] for results in probes if results)
+        if not distances:
+            threshold = RELEVANCE_MAX_DISTANCE
+        else:
+            floor = distances[int((len(distances) - 1) * RELEVANCE_PROBE_PERCENTILE)]
+            threshold = min(RELEVANCE_MAX_DISTANCE, floor)
+            print(f"工作区 {self.workspace} 相关性阈值校准: 探测问题最相关距离 "
+                  f"{[round(d, 3) for d in distances]}，阈值取 {threshold:.3f}")
+        self._relevance_threshold = (etag, threshold)
+        return threshold
+
     def get_all_documents(self) -> List[str]:
-        """获取所有文档名称"""
+        """获取所有文档名称（语料未变化时直接使用缓存）"""
+        if self._documents_cache is not None:
+            return list(self._documents_cache)
         try:
-            results = self.collection.get()
+            version = self.version
             sources = set()
-            for metadata in results['metadatas']:
-                sources.add(metadata['source'])
+            for shard in self.shards():
+                results = shard.get(include=["metadatas"])
+                for metadata in results['metadatas']:
+                    sources.add(metadata['source'])
+            # 扫描期间语料有变化时不写入缓存
+            if version == self.version:
+                self._documents_cache = list(sources)
             return list(sources)
         except Exception as e:
             print(f"获取文档列表时出错: {e}")
             return []
 
     def delete_document(self, source: str):
-        """删除指定文档的所有块（支持原始文件名匹配）"""
+        """删除指定文档的所有块（支持原始文件名或document_id匹配）"""
         try:
-            results = self.collection.get()
-            ids_to_delete = []
             # 关键修改：解码传入的source（防止前端传递时编码残留）
             解码后的_source = urllib.parse.unquote(source)
-            for i, metadata in enumerate(results['metadatas']):
-                # 用解码后的文件名匹配元数据中的source
-                if metadata['source'] == 解码后的_source:
-                    ids_to_delete.append(results['ids'][i])
-            if ids_to_delete:
-                self.collection.delete(ids=ids_to_delete)
-                print(f"已删除文档 '{解码后的_source}' 的 {len(ids_to_delete)} 个块")
+            deleted = 0
+            for index, shard in enumerate(self.shards()):
+                # 只取匹配文档的id，避免读取整个集合
+                results = shard.get(
+                    where={"$or": [{"source": 解码后的_source}, {"document_id": 解码后的_source}]},
+                    include=[]
+                )
+                deleted += self.delete_chunks(index, results['ids'])
+            if deleted:
+                print(f"已删除文档 '{解码后的_source}' 的 {deleted} 个块")
             else:
                 print(f"未找到文档 '{解码后的_source}'")
         except Exception as e:
             print(f"删除文档时出错: {e}")
 
+    def delete_chunks(self, index: int, ids: List[str]) -> int:
+        """从指定分片删除文档块，返回删除数量"""
+        if not ids:
+            return 0
+        with self._write_lock:
+            self._get_shard(index).delete(ids=ids)
+            self._add_tombstones(index, len(ids))
+            self._bump_version()
+        return len(ids)
+
+    def _collection_ids(self, collection, batch_size: int) -> set:
+        ids = set()
+        offset = 0
+        while True:
+            batch = collection.get(limit=batch_size, offset=offset, include=[])
+            if not batch['ids']:
+                break
+            ids.update(batch['ids'])
+            offset += len(batch['ids'])
+        return ids
+
+    def _recover_compaction(self, prefix: Optional[str] = None):
+        """恢复上次压缩中断留下的集合：切换中途中断时把旧集合改回原名，其余临时集合直接删除"""
+        names = {collection.name for collection in self.client.list_collections()}
+        for i in range(self.num_shards):
+            name = self._shard_name(i, prefix)
+            old_name, tmp_name = f"{name}-old", f"{name}-compacting"
+            if name not in names and old_name in names:
+                print(f"工作区 '{self.workspace}' 分片 {name} 压缩切换时中断，恢复原集合")
+                self.client.get_collection(old_name).modify(name=name)
+                names.discard(old_name)
+            for leftover in (old_name, tmp_name):
+                if leftover in names:
+                    self.client.delete_collection(leftover)
+
+    def compact_shard(self, index: int, batch_size: int = 500, pause: float = 0.0) -> int:
+        """重建分片集合以清除已删除向量占用的空间，返回复制的块数
+
+        先在不持有写锁的情况下把数据复制到临时集合（写入不受影响），再在写锁内同步复制期间的增删并切换：
+        旧集合先改名为"-old"，临时集合改为原名后才删除旧集合，任何一步中断都可在下次加载时恢复。
+        只在持有该工作区的进程内执行，否则其他进程的集合引用会失效。
+        """
+        name = self._shard_name(index)
+        old_name, tmp_name = f"{name}-old", f"{name}-compacting"
+        old = self._get_shard(index)
+        try:
+            self.client.delete_collection(tmp_name)
+        except ValueError:
+            pass
+        version = self.version
+        new = self.client.create_collection(name=tmp_name, metadata=old.metadata)
+        offset = 0
+        while True:
+            batch = old.get(limit=batch_size, offset=offset, include=["embeddings", "documents", "metadatas"])
+            if not batch['ids']:
+                break
+            # 复制期间可能有增删导致分页重叠，用upsert避免重复
+            new.upsert(
+                ids=batch['ids'],
+                embeddings=batch['embeddings'],
+                documents=batch['documents'],
+                metadatas=batch['metadatas']
+            )
+            offset += len(batch['ids'])
+            if pause:
+                time.sleep(pause)
+
+        with self._write_lock:
+            if self._shard_name(index) != name:
+                # 复制期间已切换到新索引
+                self.client.delete_collection(tmp_name)
+                return 0
+            # 同步复制期间的增删
+            if self.version != version:
+                old_ids = self._collection_ids(old, batch_size)
+                new_ids = self._collection_ids(new, batch_size)
+                stale = list(new_ids - old_ids)
+                missing = list(old_ids - new_ids)
+                for i in range(0, len(stale), batch_size):
+                    new.delete(ids=stale[i:i + batch_size])
+                for i in range(0, len(missing), batch_size):
+                    batch = old.get(ids=missing[i:i + batch_size],
+                                    include=["embeddings", "documents", "metadatas"])
+                    new.add(ids=batch['ids'], embeddings=batch['embeddings'],
+                            documents=batch['documents'], metadatas=batch['metadatas'])
+            copied = new.count()
+            # 旧集合改名后再把新集合改为原名，最后删除旧集合
+            old.modify(name=old_name)
+            new.modify(name=name)
+            with self._shards_lock:
+                self._shards[index] = new
+            self.client.delete_collection(old_name)
+            self._tombstones.pop(name, None)
+            with open(self._tombstones_path, 'w', encoding='utf-8') as f:
+                json.dump(self._tombstones, f)
+        print(f"工作区 '{self.workspace}' 分片 {name} 压缩完成，保留 {copied} 个块")
+        return copied
+
+    def vacuum(self, min_free_bytes: int = 0) -> Optional[int]:
+        """回收chroma.sqlite3中已释放的页（Chroma删除数据后不会自动VACUUM）
+
+        空闲页不足min_free_bytes时跳过并返回None，否则返回文件缩小的字节数。执行期间暂停写入。
+        """
+        path = os.path.join(self.db_path, "chroma.sqlite3")
+        if not os.path.exists(path):
+            return None
+        with self._write_lock:
+            conn = sqlite3.connect(path, timeout=60)
+            try:
+                page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+                free_bytes = conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+                if free_bytes < min_free_bytes:
+                    return None
+                size_before = os.path.getsize(path)
+                conn.execute("VACUUM")
+            finally:
+                conn.close()
+        reclaimed = size_before - os.path.getsize(path)
+        print(f"工作区 '{self.workspace}' VACUUM完成，回收 {reclaimed / 1024 / 1024:.2f}MB")
+        return reclaimed
+
+    def close(self):
+        """尽力释放客户端资源（Chroma按路径缓存System，需要显式移除才会释放索引内存）"""
+        self._shards.clear()
+        try:
+            cache = getattr(type(self.client), "_identifer_to_system", None)
+            identifier = getattr(self.client, "_identifier", None)
+            if cache is not None and identifier in cache:
+                cache.pop(identifier).stop()
+        except Exception as e:
+            print(f"释放工作区 '{self.workspace}' 资源时出错: {e}")
+
+
+class WorkspaceManager:
+    """按工作区懒加载VectorDatabase，同名嵌入模型只加载一次，空闲或超出上限的工作区会被释放
+
+    正在使用中的工作区（通过use()占用）不会被释放。
+    """
+
+    def __init__(self, max_loaded: int = MAX_LOADED_WORKSPACES, idle_seconds: float = WORKSPACE_IDLE_SECONDS):
+        self.max_loaded = max_loaded
+        self.idle_seconds = idle_seconds
+        self._databases: "OrderedDict[str, VectorDatabase]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        # 各工作区当前的占用数
+        self._in_use: Dict[str, int] = {}
+        # 正在加载的工作区，其他请求等待加载完成
+        self._loading: Dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        self._models: Dict[str, SentenceTransformer] = {}
+        self._models_lock = threading.Lock()
+
+    def load_model(self, name: str) -> SentenceTransformer:
+        """按名称获取嵌入模型（各工作区共享）"""
+        with self._models_lock:
+            model = self._models.get(name)
+            if model is None:
+                model = load_embedding_model(name)
+                self._models[name] = model
+            return model
+
+    def prune_models(self) -> List[str]:
+        """释放已加载工作区都不再使用的嵌入模型（重建索引切换后调用），返回被释放的模型名"""
+        with self._lock:
+            in_use = {db.index["embedding_model"] for db in self._databases.values()}
+        pruned = []
+        with self._models_lock:
+            for name in list(self._models.keys()):
+                if name not in in_use and name != EMBEDDING_MODEL:
+                    print(f"释放嵌入模型: {name}")
+                    del self._models[name]
+                    pruned.append(name)
+        # 同时关闭这些模型的编码进程池（每个工作进程各持有一份模型）
+        for name in pruned:
+            close_encode_pool(name)
+        return pruned
+
+    @contextmanager
+    def use(self, workspace: str = DEFAULT_WORKSPACE, touch: bool = True):
+        """在with块内占用工作区的向量数据库，占用期间不会被释放
+
+        首次访问时在锁外加载（同一工作区只加载一次，其他请求等待），不会阻塞其他工作区的请求。
+        touch为False时不更新最近使用时间和LRU顺序（用于后台维护扫描），
+        因此为此临时加载的工作区在使用结束后会优先被释放。
+        """
+        while True:
+            with self._lock:
+                db = self._databases.get(workspace)
+                if db is not None:
+                    self._acquire_locked(workspace, touch)
+                    break
+                loading = self._loading.get(workspace)
+                owner = loading is None
+                if owner:
+                    loading = self._loading[workspace] = threading.Event()
+            if not owner:
+                # 其他请求正在加载该工作区，加载完成（或失败）后重新获取
+                loading.wait()
+                continue
+            try:
+                print(f"加载工作区: {workspace}")
+                db = VectorDatabase(workspace, model_loader=self.load_model)
+                with self._lock:
+                    self._databases[workspace] = db
+                    if not touch:
+                        self._databases.move_to_end(workspace, last=False)
+                        self._last_used[workspace] = 0
+                    self._acquire_locked(workspace, touch)
+            finally:
+                with self._lock:
+                    del self._loading[workspace]
+                loading.set()
+            break
+        try:
+            yield db
+        finally:
+            with self._lock:
+                self._in_use[workspace] -= 1
+                if not self._in_use[workspace]:
+                    del self._in_use[workspace]
+                evicted = self._pop_evictable_locked()
+            self._close(evicted)
+
+    def _acquire_locked(self, workspace: str, touch: bool):
+        if touch:
+            self._databases.move_to_end(workspace)
+            self._last_used[workspace] = time.time()
+        self._in_use[workspace] = self._in_use.get(workspace, 0) + 1
+
+    def loaded_workspaces(self) -> List[str]:
+        with self._lock:
+            return list(self._databases.keys())
+
+    def evict_idle(self):
+        """释放空闲超时的工作区"""
+        with self._lock:
+            evicted = self._pop_evictable_locked()
+        self._close(evicted)
+
+    def _pop_evictable_locked(self) -> List[VectorDatabase]:
+        """从缓存中移除空闲超时或超出数量上限的工作区（使用中的除外），返回待关闭的数据库"""
+        now = time.time()
+        evicted = []
+        for workspace in list(self._databases.keys()):
+            if self._in_use.get(workspace):
+                continue
+            too_many = len(self._databases) > self.max_loaded
+            idle = now - self._last_used.get(workspace, now) > self.idle_seconds
+            if not (too_many or idle):
+                continue
+            evicted.append(self._databases.pop(workspace))
+            self._last_used.pop(workspace, None)
+        return evicted
+
+    def _close(self, databases: List[VectorDatabase]):
+        # 在锁外关闭，避免阻塞其他工作区的请求
+        for db in databases:
+            print(f"释放工作区: {db.workspace}")
+            db.close()
+
 
 # 测试向量数据库
 if __name__ == "__main__":
@@ -109,9 +741,10 @@ if __name__ == "__main__":
     db.add_documents(test_documents)
     # 搜索测试
     print("\n2. 搜索测试...")
-    results = db.search("什么是人工智能？")
-    for i, (doc, metadata) in enumerate(results):
-        print(f"结果 {i + 1}: {doc[:50]}... (来源: {metadata['source']})")
+    results = db.search_with_scores("什么是人工智能？")
+    for i, (doc, metadata, distance) in enumerate(results):
+        print(f"结果 {i + 1}: {doc[:50]}... (来源: {metadata['source']}, 距离: {distance:.4f})")
+    print(f"通过相关性筛选: {len(filter_by_relevance(results, db.relevance_threshold()))} 个")
     # 获取文档列表
     print("\n3. 文档列表...")
     documents = db.get_all_documents()